@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+"""
+Measure the startup cost of smn_caller.py: the time to import it, the time
+from interpreter start to the first called sample, and the cost of starting
+region counting workers with each multiprocessing start method.
+Each measurement runs in a fresh interpreter.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+import time
+import json
+import multiprocessing as mp
+import numpy as np
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+test_data_dir = os.path.join(package_dir, "depth_calling", "tests", "test_data")
+HEAVY_MODULES = ["scipy", "statsmodels", "pysam"]
+
+IMPORT_SCRIPT = """
+import sys, json
+import smn_caller
+print(json.dumps([a for a in %r if a in sys.modules]))
+"""
+
+FIRST_SAMPLE_SCRIPT = """
+from caller.smn_cn_caller import SmnCaller
+smn_caller = SmnCaller(
+    %(genome)r, reference_fasta=%(reference)r, region_file=%(region_file)r
+)
+smn_caller.call(%(bam)r)
+"""
+
+# Workers import the region counting module, as region counting workers
+# do to run their tasks.
+WORKER_SCRIPT = """
+import importlib
+import multiprocessing as mp
+import depth_calling.bin_count
+if __name__ == "__main__" and %(workers)i > 0:
+    pool = mp.get_context(%(method)r).Pool(
+        %(workers)i, importlib.import_module, ("depth_calling.bin_count",)
+    )
+    pool.map(abs, range(%(workers)i))
+    pool.close()
+    pool.join()
+"""
+
+
+def load_parameters():
+    """Return parameters."""
+    parser = argparse.ArgumentParser(
+        description="Measure the import time, time to first sample and worker \
+        start cost of smn_caller.py."
+    )
+    parser.add_argument(
+        "--bam",
+        help="BAM/CRAM file used for the first sample. Default is the test BAM",
+        default=os.path.join(test_data_dir, "NA12885.bam"),
+        required=False,
+    )
+    parser.add_argument(
+        "--genome",
+        help="Reference genome, select from 19, 37, or 38. Default is 37",
+        default="37",
+        required=False,
+    )
+    parser.add_argument(
+        "--regionFile",
+        help="Region file used for the first sample. Default is the short test \
+        region file, or the region file of the genome with --bam",
+        required=False,
+    )
+    parser.add_argument(
+        "--reference",
+        help="Optional path to reference fasta file for CRAM",
+        required=False,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of workers started per pool. Default is 4",
+        type=int,
+        default=4,
+        required=False,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of times each measurement is repeated. Default is 5",
+        type=int,
+        default=5,
+        required=False,
+    )
+    return parser.parse_args()
+
+
+def time_script(script, repeat):
+    """
+    Return the median wall time of running a script in a fresh interpreter
+    and the output of its last run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=package_dir,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), output
+
+
+def main():
+    parameters = load_parameters()
+    region_file = parameters.regionFile
+    if region_file is None:
+        if parameters.bam == os.path.join(test_data_dir, "NA12885.bam"):
+            region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        else:
+            region_file = os.path.join(
+                package_dir, "data", "SMN_region_%s.bed" % parameters.genome
+            )
+    repeat = parameters.repeat
+
+    import_time, output = time_script(IMPORT_SCRIPT % HEAVY_MODULES, repeat)
+    print("%-40s%8.3f s" % ("Start and import smn_caller", import_time))
+    print(
+        "%-40s%s"
+        % ("Heavy modules imported", ", ".join(json.loads(output)) or "none")
+    )
+    first_sample_time, _ = time_script(
+        FIRST_SAMPLE_SCRIPT
+        % {
+            "genome": parameters.genome,
+            "bam": os.path.abspath(parameters.bam),
+            "region_file": os.path.abspath(region_file),
+            "reference": parameters.reference,
+        },
+        repeat,
+    )
+    print("%-40s%8.3f s" % ("Time to first sample", first_sample_time))
+    # The cost of starting the pool is measured against the same script
+    # without a pool.
+    no_worker_time, _ = time_script(
+        WORKER_SCRIPT % {"method": "", "workers": 0}, repeat
+    )
+    for method in mp.get_all_start_methods():
+        worker_time, _ = time_script(
+            WORKER_SCRIPT % {"method": method, "workers": parameters.workers}, repeat
+        )
+        print(
+            "%-40s%8.3f s"
+            % (
+                "Start %s worker (pool of %i)" % (method, parameters.workers),
+                (worker_time - no_worker_time) / parameters.workers,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -25,16 +25,17 @@ import math
 import os
 import sys
 from collections import namedtuple, Counter
-from scipy.stats import poisson
+import numpy as np
 
 dir_name = os.path.join(os.path.dirname(os.path.dirname(__file__)), "depth_calling")
 if os.path.exists(dir_name):
     sys.path.append(dir_name)
 from depth_calling.copy_number_call import (
-    call_reg1_cn,
+    call_reg1_cn_batch,
     process_raw_call_gc,
     process_raw_call_denovo,
 )
+from depth_calling.numerics import xlogy
 
 SMA_CUTOFF = 1e-6
 TOTAL_NUM_SITES = 16
@@ -55,15 +56,28 @@ def get_fraction(lsnp1, lsnp2):
     return [safe_division(count1, count1 + lsnp2[i]) for i, count1 in enumerate(lsnp1)]
 
 
+def smn1_cn_zero_batch(counts_smn1, counts_smn2, mdepths):
+    """
+    Return the likelihood ratios between SMN1 CN=0 and SMN1 CN=1
+    for arrays of splice site counts and median depths, e.g. across samples.
+    The ratios are computed in log space so that they do not turn into nan
+    at high depth, where both likelihoods underflow.
+    """
+    counts_smn1 = np.asarray(counts_smn1, dtype=float)
+    nsum = counts_smn1 + np.asarray(counts_smn2, dtype=float)
+    depthexpected0 = (ERROR_RATE / 3) * nsum
+    # haploid depth
+    depthexpected1 = np.asarray(mdepths, dtype=float) / 2
+    # The log-factorial term is the same for both CNs and cancels out.
+    log_prob_cp0 = xlogy(counts_smn1, depthexpected0) - depthexpected0
+    log_prob_cp1 = xlogy(counts_smn1, depthexpected1) - depthexpected1
+    with np.errstate(over="ignore"):
+        return np.exp(log_prob_cp0 - log_prob_cp1)
+
+
 def smn1_cn_zero(count_smn1, count_smn2, mdepth):
     """Return the likelihood ratio between SMN1 CN=0 and SMN1 CN=1."""
-    nsum = count_smn1 + count_smn2
-    depthexpected0 = (ERROR_RATE / 3) * float(nsum)
-    # haploid depth
-    depthexpected1 = float(mdepth) / 2
-    prob_cp0 = poisson.pmf(count_smn1, depthexpected0)
-    prob_cp1 = poisson.pmf(count_smn1, depthexpected1)
-    return prob_cp0 / prob_cp1
+    return float(smn1_cn_zero_batch([count_smn1], [count_smn2], [mdepth])[0])
 
 
 def get_raw_smn1_cn(full_length_cn, smn1_fraction):
@@ -214,6 +228,10 @@ def get_smn12_call(raw_cn_call, lsnp1, lsnp2, var_ref, var_alt, mdepth):
     )
     raw_cn_call = update_full_length_cn(raw_cn_call)
     full_length_cn = raw_cn_call.exon78_cn
+    # Likelihood ratio of zero copy of SMN1 at the splice variant site
+    sma_likelihood_ratio = smn1_cn_zero(
+        lsnp1[SPLICE_INDEX], lsnp2[SPLICE_INDEX], mdepth
+    )
 
     if full_length_cn is None:
         # No-call for full-length CN
@@ -223,9 +241,6 @@ def get_smn12_call(raw_cn_call, lsnp1, lsnp2, var_ref, var_alt, mdepth):
         # In cases where full length copy number is no-call,
         # Test for zero copy of SMN1 at the splice variant site.
         # If true, report range for SMN2 CN
-        sma_likelihood_ratio = smn1_cn_zero(
-            lsnp1[SPLICE_INDEX], lsnp2[SPLICE_INDEX], mdepth
-        )
         if sma_likelihood_ratio > 1 / SMA_CUTOFF:
             cn_smn2 = "%i-%i" % (math.floor(full_length_cn), math.ceil(full_length_cn))
             dout = smn_call(
@@ -273,20 +288,19 @@ def get_smn12_call(raw_cn_call, lsnp1, lsnp2, var_ref, var_alt, mdepth):
 
         # Most likely SMN1 CN (or the best two if posterior probability is low)
         # at each site.
-        cn_prob = []
-        for i in range(TOTAL_NUM_SITES):
-            cn_prob.append(call_reg1_cn(full_length_cn, lsnp1[i], lsnp2[i]))
-        # Combine all 6 sites and make a call.
-        combined_call = call_reg1_cn(
+        # Each site, all selected sites combined and the targeted variant
+        # are called together in one batch.
+        lcalls = call_reg1_cn_batch(
             full_length_cn,
-            sum([lsnp1[a] for a in SELECTED_SITES_INDEX]),
-            sum([lsnp2[a] for a in SELECTED_SITES_INDEX]),
+            list(lsnp1[:TOTAL_NUM_SITES])
+            + [sum([lsnp1[a] for a in SELECTED_SITES_INDEX]), var_alt[0]],
+            list(lsnp2[:TOTAL_NUM_SITES])
+            + [sum([lsnp2[a] for a in SELECTED_SITES_INDEX]), var_ref[0]],
         )
+        cn_prob = lcalls[:TOTAL_NUM_SITES]
+        combined_call = lcalls[TOTAL_NUM_SITES]
 
         tag, cn_smn1, lsitecall_loose = get_smn1_call_and_tag(cn_prob, combined_call)
-        sma_likelihood_ratio = smn1_cn_zero(
-            lsnp1[SPLICE_INDEX], lsnp2[SPLICE_INDEX], mdepth
-        )
         is_sma = get_sma_status(lsitecall_loose, cn_prob, cn_smn1, sma_likelihood_ratio)
         is_carrier = get_carrier_status(
             lsitecall_loose, cn_prob, cn_smn1, sma_likelihood_ratio
@@ -297,7 +311,7 @@ def get_smn12_call(raw_cn_call, lsnp1, lsnp2, var_ref, var_alt, mdepth):
         raw_var_cn = None
         var_fraction = get_fraction(var_alt, var_ref)
         raw_var_cn = get_raw_smn1_cn(full_length_cn, var_fraction)[0]
-        var_cn = [call_reg1_cn(full_length_cn, var_alt[0], var_ref[0])]
+        var_cn = [lcalls[TOTAL_NUM_SITES + 1]]
         var_cn_filtered = process_raw_call_denovo(
             var_cn, POSTERIOR_CUTOFF_MEDIUM, POSTERIOR_CUTOFF_LOOSE, keep_none=False
         )
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import os
+import json
+import heapq
+
+TSV_HEADER = [
+    "Sample",
+    "isSMA",
+    "isCarrier",
+    "SMN1_CN",
+    "SMN2_CN",
+    "SMN2delta7-8_CN",
+    "Total_CN_raw",
+    "Full_length_CN_raw",
+    "g.27134T>G_CN",
+    "SMN1_CN_raw",
+]
+
+
+def get_tsv_line(sample_id, final_call):
+    """Return the tsv line of a sample."""
+    output_per_sample = [
+        sample_id,
+        final_call["isSMA"],
+        final_call["isCarrier"],
+        final_call["SMN1"],
+        final_call["SMN2"],
+        final_call["SMN2delta78"],
+        final_call["Total_CN_raw"],
+        final_call["Full_length_CN_raw"],
+        final_call["g27134TG_CN"],
+        ",".join([str(a) for a in final_call["SMN1_CN_raw"]]),
+    ]
+    return "\t".join([str(a) for a in output_per_sample]) + "\n"
+
+
+def write_to_tsv(final_output, out_tsv):
+    """Write to tsv output."""
+    with open(out_tsv, "w") as tsv_output:
+        tsv_output.write("\t".join(TSV_HEADER) + "\n")
+        for sample_id in final_output:
+            tsv_output.write(get_tsv_line(sample_id, final_output[sample_id]))
+
+
+class StreamingOutput:
+    """
+    Write each sample's calls to a jsonl file and a tsv file as soon as the
+    sample is called. Each jsonl line is a json object with a single sample.
+    """
+
+    def __init__(self, out_jsonl, out_tsv, append=False):
+        mode = "a" if append else "w"
+        self.jsonl_output = open(out_jsonl, mode)
+        self.tsv_output = open(out_tsv, mode)
+        if not append:
+            self.tsv_output.write("\t".join(TSV_HEADER) + "\n")
+        self.flush()
+
+    def write(self, sample_id, final_call):
+        self.jsonl_output.write(json.dumps({sample_id: final_call}) + "\n")
+        self.tsv_output.write(get_tsv_line(sample_id, final_call))
+        self.flush()
+
+    def flush(self):
+        for output in [self.jsonl_output, self.tsv_output]:
+            output.flush()
+            os.fsync(output.fileno())
+
+    def close(self):
+        self.jsonl_output.close()
+        self.tsv_output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_jsonl(in_jsonl):
+    """
+    Yield the sample id and calls of each complete line in a jsonl file.
+    A last line cut short by an interrupted run is skipped.
+    """
+    with open(in_jsonl) as read_jsonl_file:
+        for line in read_jsonl_file:
+            if not line.endswith("\n"):
+                break
+            for sample_id, final_call in json.loads(line).items():
+                yield sample_id, final_call
+
+
+def resume_streaming_output(out_jsonl, out_tsv):
+    """
+    Prepare the output of an interrupted streaming run to be appended to.
+    Drop an incomplete last jsonl line, rewrite the tsv from the complete
+    jsonl records and return the ids of the samples that are already called.
+    """
+    completed_samples = set()
+    complete_size = 0
+    with open(out_jsonl, "rb") as read_jsonl_file:
+        for line in read_jsonl_file:
+            if not line.endswith(b"\n"):
+                break
+            complete_size += len(line)
+            completed_samples.update(json.loads(line))
+    with open(out_jsonl, "r+b") as jsonl_output:
+        jsonl_output.truncate(complete_size)
+    with open(out_tsv, "w") as tsv_output:
+        tsv_output.write("\t".join(TSV_HEADER) + "\n")
+        for sample_id, final_call in read_jsonl(out_jsonl):
+            tsv_output.write(get_tsv_line(sample_id, final_call))
+    return completed_samples
+
+
+def finalize_json(in_jsonl, out_json):
+    """
+    Convert a jsonl file into the single json file written by the caller,
+    one sample at a time.
+    """
+    with open(out_json, "w") as json_output:
+        json_output.write("{")
+        for i, (sample_id, final_call) in enumerate(read_jsonl(in_jsonl)):
+            if i > 0:
+                json_output.write(", ")
+            json_output.write(json.dumps(sample_id) + ": " + json.dumps(final_call))
+        json_output.write("}")
+
+
+def read_jsonl_in_order(in_jsonl, sample_order):
+    """
+    Yield the position, sample id and calls of each sample in a jsonl file,
+    checking that the samples are in the order given by sample_order.
+    """
+    last_position = -1
+    for sample_id, final_call in read_jsonl(in_jsonl):
+        if sample_id not in sample_order:
+            raise Exception(
+                "Sample %s in %s is not in the manifest." % (sample_id, in_jsonl)
+            )
+        position = sample_order[sample_id]
+        if position <= last_position:
+            raise Exception("Samples in %s are not in manifest order." % in_jsonl)
+        last_position = position
+        yield position, sample_id, final_call
+
+
+def merge_jsonl(in_jsonls, sample_order, out_json, out_tsv):
+    """
+    Merge the jsonl files of several shards, each in manifest order, into the
+    json and tsv files written by the caller, in manifest order.
+    Only one sample per shard is held in memory at a time, and a sample
+    found in more than one shard is written once.
+    """
+    merged_calls = heapq.merge(
+        *[read_jsonl_in_order(a, sample_order) for a in in_jsonls],
+        key=lambda call: call[0]
+    )
+    with open(out_json, "w") as json_output, open(out_tsv, "w") as tsv_output:
+        json_output.write("{")
+        tsv_output.write("\t".join(TSV_HEADER) + "\n")
+        last_position = None
+        for position, sample_id, final_call in merged_calls:
+            if position == last_position:
+                continue
+            if last_position is not None:
+                json_output.write(", ")
+            last_position = position
+            json_output.write(json.dumps(sample_id) + ": " + json.dumps(final_call))
+            tsv_output.write(get_tsv_line(sample_id, final_call))
+        json_output.write("}")
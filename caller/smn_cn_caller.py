@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+
+import os
+import logging
+from collections import namedtuple
+
+from depth_calling.snp_count import (
+    get_supporting_reads_panels,
+    get_fraction,
+    load_site_panel,
+)
+from depth_calling.gmm import Gmm
+from depth_calling.utilities import (
+    parse_gmm_file,
+    parse_region_file,
+    AlignmentSession,
+)
+from depth_calling.bin_count import (
+    get_normed_depth,
+    get_normed_depth_from_count_dic,
+    get_count_from_file,
+    get_count_meta_from_file,
+    get_read_length,
+)
+from depth_calling.parallel import (
+    get_worker_pool,
+    start_worker_pool,
+    stop_worker_pool,
+)
+from caller.call_smn12 import get_smn12_call
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+GENOMES = ["19", "37", "38"]
+MAD_THRESHOLD = 0.11
+# Allele counts stored in count files by smn_count.py, for the SNP panel
+# and the target variant panel
+COUNT_FILE_ALLELE_KEYS = [
+    ("SMN1_read_support", "SMN2_read_support"),
+    ("g27134TG_REF_count", "g27134TG_ALT_count"),
+]
+
+cn_call = namedtuple("cn_call", "exon16_cn exon16_depth exon78_cn exon78_depth")
+sample_call = namedtuple(
+    "sample_call",
+    "Coverage_MAD Median_depth \
+    Full_length_CN_raw Total_CN_raw \
+    SMN1_read_support SMN2_read_support SMN1_fraction \
+    g27134TG_REF_count g27134TG_ALT_count",
+)
+
+
+def has_allele_counts(count_meta):
+    """Return whether count file values include all allele counts."""
+    return all(key in count_meta for keys in COUNT_FILE_ALLELE_KEYS for key in keys)
+
+
+def get_allele_counts_from_meta(count_meta):
+    """Return the SNP and target variant allele counts in count file values."""
+    return [
+        (count_meta[key1], count_meta[key2]) for key1, key2 in COUNT_FILE_ALLELE_KEYS
+    ]
+
+
+class SmnCaller:
+    """
+    SMN copy number caller that loads the region, SNP, target variant and
+    GMM resources of a genome once and calls any number of samples with them.
+    With more than one thread, regions are counted in one worker pool that
+    is kept until close is called, or the caller is used as a context manager.
+    """
+
+    def __init__(
+        self,
+        genome,
+        threads=1,
+        reference_fasta=None,
+        count_engine="pysam",
+        count_cache=None,
+        gc_engine="precomputed",
+        snp_engine="single_pass",
+        region_file=None,
+        datadir=DATA_DIR,
+    ):
+        if genome not in GENOMES:
+            raise Exception("Genome not recognized. Select from 19, 37, or 38")
+        if region_file is None:
+            region_file = os.path.join(datadir, "SMN_region_%s.bed" % genome)
+        snp_file = os.path.join(datadir, "SMN_SNP_%s.txt" % genome)
+        variant_file = os.path.join(datadir, "SMN_target_variant_%s.txt" % genome)
+        gmm_file = os.path.join(datadir, "SMN_gmm.txt")
+        for required_file in [region_file, snp_file, variant_file, gmm_file]:
+            if os.path.exists(required_file) == 0:
+                raise Exception("File %s not found." % required_file)
+
+        self.threads = threads
+        self.reference_fasta = reference_fasta
+        self.count_engine = count_engine
+        self.count_cache = count_cache
+        self.gc_engine = gc_engine
+        self.snp_engine = snp_engine
+        self.region_dic = parse_region_file(region_file)
+        self.snp_db = load_site_panel(snp_file)
+        self.variant_db = load_site_panel(variant_file)
+        gmm_parameter = parse_gmm_file(gmm_file)
+        self.gmm_exon16 = Gmm()
+        self.gmm_exon16.set_gmm_par(gmm_parameter, "exon1-6")
+        self.gmm_exon78 = Gmm()
+        self.gmm_exon78.set_gmm_par(gmm_parameter, "exon7-8")
+        self.owns_pool = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_pool(self):
+        """
+        Return the region counting pool, started on first use if there is
+        more than one thread. A pool already running in this process,
+        such as the one started by run_samples, is used instead.
+        """
+        if self.threads > 1 and get_worker_pool() is None:
+            start_worker_pool(self.threads)
+            self.owns_pool = True
+        return get_worker_pool()
+
+    def close(self):
+        """Stop the region counting pool if this caller started it."""
+        if self.owns_pool:
+            stop_worker_pool()
+            self.owns_pool = False
+
+    def call(self, bam, count_file=None):
+        """
+        Return the SMN CN calls of a sample given a bam file, and optionally
+        its count file written by smn_count.py.
+        The alignment file is not opened if the count file has the read
+        length and allele counts.
+        """
+        # The alignment file is opened once and shared by all stages.
+        with AlignmentSession(bam, self.reference_fasta) as session:
+            # 1. read counting, normalization
+            count_meta = {}
+            if count_file is not None:
+                count_meta = get_count_meta_from_file(count_file)
+                read_length = count_meta.get("read_length")
+                if read_length is None:
+                    reads = session.handle.fetch()
+                    read_length = get_read_length(reads)
+                normalized_depth = get_normed_depth_from_count_dic(
+                    get_count_from_file(count_file),
+                    self.region_dic,
+                    read_length,
+                    gc_correct=False,
+                    gc_engine=self.gc_engine,
+                )
+            else:
+                normalized_depth = get_normed_depth(
+                    session,
+                    self.region_dic,
+                    self.threads,
+                    gc_correct=False,
+                    pool=self.get_pool(),
+                    count_engine=self.count_engine,
+                    count_cache=self.count_cache,
+                    gc_engine=self.gc_engine,
+                )
+
+            # 2. Get SNP ratios and target variant counts in one pass over the reads
+            if has_allele_counts(count_meta):
+                allele_counts = get_allele_counts_from_meta(count_meta)
+            else:
+                allele_counts = get_supporting_reads_panels(
+                    session,
+                    [self.snp_db, self.variant_db],
+                    snp_engine=self.snp_engine,
+                )
+
+        return self.call_from_depth(normalized_depth, *allele_counts)
+
+    def call_from_counts(self, count_dic, count_meta):
+        """
+        Return the SMN CN calls of a sample from the read counts of its
+        regions, keyed by region name, and the read length and allele counts
+        in count_meta, as stored in a count file by smn_count.py.
+        """
+        if "read_length" not in count_meta or not has_allele_counts(count_meta):
+            raise Exception("Read length or allele counts are missing.")
+        normalized_depth = get_normed_depth_from_count_dic(
+            count_dic,
+            self.region_dic,
+            count_meta["read_length"],
+            gc_correct=False,
+            gc_engine=self.gc_engine,
+        )
+        return self.call_from_depth(
+            normalized_depth, *get_allele_counts_from_meta(count_meta)
+        )
+
+    def call_sample(self, sample_id, bam, count_file=None):
+        """
+        Return the SMN CN calls of a sample as call does, warning about
+        uneven coverage under the sample id.
+        """
+        smn_call = self.call(bam, count_file)
+        # Use normalized coverage MAD across stable regions
+        # as a sample QC measure.
+        if smn_call["Coverage_MAD"] > MAD_THRESHOLD:
+            logging.warning(
+                "Sample %s has uneven coverage. CN calls may be \
+                    unreliable.",
+                sample_id,
+            )
+        return smn_call
+
+    def call_many(self, samples):
+        """
+        Call a sequence of samples, given as (sample id, bam file, count file)
+        manifest entries, and yield the sample id and SMN CN calls of each.
+        """
+        for sample_id, bam, count_file in samples:
+            yield sample_id, self.call_sample(sample_id, bam, count_file)
+
+    def call_from_depth(self, normalized_depth, snp_read_count, variant_read_count):
+        """
+        Return the SMN CN calls of a sample given its normalized depth and
+        the allele counts at the SNP and target variant sites.
+        """
+        smn1_read_count, smn2_read_count = snp_read_count
+        var_ref_count, var_alt_count = variant_read_count
+        smn1_fraction = get_fraction(smn1_read_count, smn2_read_count)
+
+        # 3. GMM and CN call
+        normalized = normalized_depth.normalized
+        gcall_exon16 = self.gmm_exon16.gmm_call(normalized["exon16"])
+        gcall_exon78 = self.gmm_exon78.gmm_call(normalized["exon78"])
+        raw_cn_call = cn_call(
+            gcall_exon16.cn,
+            gcall_exon16.depth_value,
+            gcall_exon78.cn,
+            gcall_exon78.depth_value,
+        )
+
+        # 4. Call CN of SMN1 and SMN2
+        final_call = get_smn12_call(
+            raw_cn_call,
+            smn1_read_count,
+            smn2_read_count,
+            var_ref_count,
+            var_alt_count,
+            normalized_depth.mediandepth,
+        )
+
+        # 5. Prepare final call set
+        sample_cn_call = sample_call(
+            round(normalized_depth.mad, 3),
+            round(normalized_depth.mediandepth, 2),
+            raw_cn_call.exon78_depth,
+            raw_cn_call.exon16_depth,
+            smn1_read_count,
+            smn2_read_count,
+            [round(a, 2) for a in smn1_fraction],
+            var_ref_count,
+            var_alt_count,
+        )
+
+        doutput = sample_cn_call._asdict()
+        doutput.update(final_call._asdict())
+        return doutput
@@ -25,7 +25,12 @@ import os
 from collections import namedtuple
 import pytest
 
-from ..call_smn12 import update_full_length_cn, get_smn12_call, smn1_cn_zero
+from ..call_smn12 import (
+    update_full_length_cn,
+    get_smn12_call,
+    smn1_cn_zero,
+    smn1_cn_zero_batch,
+)
 
 SMA_CUTOFF = 1e-6
 cn_call = namedtuple("cn_call", "exon16_cn exon16_depth exon78_cn exon78_depth")
@@ -44,6 +49,20 @@ class TestCN(object):
         assert likelihood_ratio < 1 / SMA_CUTOFF
         assert likelihood_ratio > SMA_CUTOFF
 
+    def test_smn1_cn_zero_batch(self):
+        counts_smn1 = [0, 15, 2, 1, 5000]
+        counts_smn2 = [30, 15, 32, 32, 5000]
+        mdepths = [30, 30, 30, 30, 20000]
+        likelihood_ratios = smn1_cn_zero_batch(counts_smn1, counts_smn2, mdepths)
+        for i, likelihood_ratio in enumerate(likelihood_ratios[:4]):
+            assert likelihood_ratio == pytest.approx(
+                smn1_cn_zero(counts_smn1[i], counts_smn2[i], mdepths[i])
+            )
+        assert likelihood_ratios[0] > 1 / SMA_CUTOFF
+        assert likelihood_ratios[1] < SMA_CUTOFF
+        # both likelihoods underflow in linear space at high depth
+        assert likelihood_ratios[4] < SMA_CUTOFF
+
     def test_update_full_length_cn(self):
         raw_cn_call = cn_call(3, 3.01, None, 3.44)
         updated_call = update_full_length_cn(raw_cn_call)
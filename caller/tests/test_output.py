@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import sys
+import os
+import json
+import pytest
+
+from ..output import (
+    write_to_tsv,
+    StreamingOutput,
+    read_jsonl,
+    resume_streaming_output,
+    finalize_json,
+    merge_jsonl,
+)
+
+sample_calls = {
+    "HG00096": {
+        "Coverage_MAD": 0.066,
+        "Median_depth": 48.75,
+        "Full_length_CN_raw": 4.048,
+        "Total_CN_raw": 3.9,
+        "SMN1": 2,
+        "SMN2": 2,
+        "SMN2delta78": 0,
+        "isCarrier": False,
+        "isSMA": False,
+        "SMN1_CN_raw": [2.27, 1.91, 2.34],
+        "Info": "PASS:Majority",
+        "Confidence": [[2], [2, 0.677, 3, 0.32]],
+        "g27134TG_CN": 0,
+    },
+    "HG00097": {
+        "Coverage_MAD": 0.071,
+        "Median_depth": 31.2,
+        "Full_length_CN_raw": 3.46,
+        "Total_CN_raw": 4.66,
+        "SMN1": None,
+        "SMN2": None,
+        "SMN2delta78": None,
+        "isCarrier": None,
+        "isSMA": None,
+        "SMN1_CN_raw": [0.0, 0.55, 1.2],
+        "Info": "FLCNnoCall",
+        "Confidence": [None, None, None],
+        "g27134TG_CN": None,
+    },
+}
+
+
+class TestOutput(object):
+    def test_streaming_output(self, tmp_path):
+        out_jsonl = str(tmp_path / "stream.jsonl")
+        out_tsv = str(tmp_path / "stream.tsv")
+        with StreamingOutput(out_jsonl, out_tsv) as streaming_output:
+            for sample_id in sample_calls:
+                streaming_output.write(sample_id, sample_calls[sample_id])
+        assert dict(read_jsonl(out_jsonl)) == sample_calls
+
+        # same output as writing everything at the end of the run
+        out_json = str(tmp_path / "stream.json")
+        finalize_json(out_jsonl, out_json)
+        with open(out_json) as read_json:
+            streamed_json = read_json.read()
+        assert streamed_json == json.dumps(sample_calls)
+        write_to_tsv(sample_calls, str(tmp_path / "all.tsv"))
+        with open(out_tsv) as tsv1, open(str(tmp_path / "all.tsv")) as tsv2:
+            assert tsv1.read() == tsv2.read()
+
+    def test_read_interrupted_jsonl(self, tmp_path):
+        out_jsonl = str(tmp_path / "stream.jsonl")
+        with open(out_jsonl, "w") as jsonl_output:
+            jsonl_output.write(json.dumps({"HG00096": sample_calls["HG00096"]}))
+            jsonl_output.write("\n")
+            jsonl_output.write(json.dumps({"HG00097": sample_calls["HG00097"]})[:50])
+        assert [a[0] for a in read_jsonl(out_jsonl)] == ["HG00096"]
+
+    def test_finalize_empty_jsonl(self, tmp_path):
+        out_jsonl = str(tmp_path / "stream.jsonl")
+        open(out_jsonl, "w").close()
+        finalize_json(out_jsonl, str(tmp_path / "stream.json"))
+        with open(str(tmp_path / "stream.json")) as read_json:
+            assert json.load(read_json) == {}
+
+    def test_resume_streaming_output(self, tmp_path):
+        out_jsonl = str(tmp_path / "stream.jsonl")
+        out_tsv = str(tmp_path / "stream.tsv")
+        # a run interrupted while writing the second sample
+        with StreamingOutput(out_jsonl, out_tsv) as streaming_output:
+            streaming_output.write("HG00096", sample_calls["HG00096"])
+        with open(out_jsonl, "a") as jsonl_output:
+            jsonl_output.write(json.dumps({"HG00097": sample_calls["HG00097"]})[:50])
+        with open(out_tsv, "a") as tsv_output:
+            tsv_output.write("HG00097\tNone")
+
+        completed_samples = resume_streaming_output(out_jsonl, out_tsv)
+        assert completed_samples == set(["HG00096"])
+        with StreamingOutput(out_jsonl, out_tsv, append=True) as streaming_output:
+            streaming_output.write("HG00097", sample_calls["HG00097"])
+        assert dict(read_jsonl(out_jsonl)) == sample_calls
+        write_to_tsv(sample_calls, str(tmp_path / "all.tsv"))
+        with open(out_tsv) as tsv1, open(str(tmp_path / "all.tsv")) as tsv2:
+            assert tsv1.read() == tsv2.read()
+
+    def test_merge_jsonl(self, tmp_path):
+        sample_order = {"HG00095": 0, "HG00096": 1, "HG00097": 2}
+        shard_jsonls = []
+        for i, sample_ids in enumerate([["HG00097"], ["HG00096"], []]):
+            out_jsonl = str(tmp_path / ("shard%i.jsonl" % i))
+            out_tsv = str(tmp_path / ("shard%i.tsv" % i))
+            with StreamingOutput(out_jsonl, out_tsv) as streaming_output:
+                for sample_id in sample_ids:
+                    streaming_output.write(sample_id, sample_calls[sample_id])
+            shard_jsonls.append(out_jsonl)
+        out_json = str(tmp_path / "merged.json")
+        out_tsv = str(tmp_path / "merged.tsv")
+        merge_jsonl(shard_jsonls, sample_order, out_json, out_tsv)
+        # same output as calling all samples in one run
+        with open(out_json) as json_output:
+            assert json_output.read() == json.dumps(sample_calls)
+        write_to_tsv(sample_calls, str(tmp_path / "all.tsv"))
+        with open(out_tsv) as tsv1, open(str(tmp_path / "all.tsv")) as tsv2:
+            assert tsv1.read() == tsv2.read()
+
+        with pytest.raises(Exception):
+            merge_jsonl(shard_jsonls, {"HG00096": 0}, out_json, out_tsv)
+        # samples need to be in manifest order within each shard
+        out_jsonl = str(tmp_path / "unordered.jsonl")
+        with StreamingOutput(out_jsonl, str(tmp_path / "unordered.tsv")) as output:
+            for sample_id in ["HG00097", "HG00096"]:
+                output.write(sample_id, sample_calls[sample_id])
+        with pytest.raises(Exception):
+            merge_jsonl([out_jsonl], sample_order, out_json, out_tsv)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+
+import sys
+import os
+import pytest
+
+from ..smn_cn_caller import SmnCaller, COUNT_FILE_ALLELE_KEYS
+from depth_calling.bin_count import get_region_counts
+from depth_calling.snp_count import get_supporting_reads_panels
+from depth_calling.parallel import get_worker_pool
+
+test_data_dir = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    "depth_calling",
+    "tests",
+    "test_data",
+)
+bam = os.path.join(test_data_dir, "NA12885.bam")
+region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+
+
+class TestSmnCaller(object):
+    def test_call(self):
+        smn_caller = SmnCaller("37", region_file=region_file)
+        smn_call = smn_caller.call(bam)
+        assert smn_call["SMN1"] == 2
+        assert smn_call["SMN2"] == 2
+        assert smn_call["isSMA"] is False
+        assert smn_call["isCarrier"] is False
+
+        count_dic, read_length = get_region_counts(bam, smn_caller.region_dic)
+        count_meta = {"read_length": read_length}
+        allele_counts = get_supporting_reads_panels(
+            bam, [smn_caller.snp_db, smn_caller.variant_db]
+        )
+        for keys, counts in zip(COUNT_FILE_ALLELE_KEYS, allele_counts):
+            count_meta.update(zip(keys, counts))
+        assert smn_caller.call_from_counts(count_dic, count_meta) == smn_call
+
+        del count_meta["SMN1_read_support"]
+        with pytest.raises(Exception):
+            smn_caller.call_from_counts(count_dic, count_meta)
+
+    def test_call_many(self):
+        smn_caller = SmnCaller("37", region_file=region_file)
+        samples = [("NA12885", bam, None), ("NA12885_2", bam, None)]
+        smn_calls = list(smn_caller.call_many(samples))
+        assert [a[0] for a in smn_calls] == ["NA12885", "NA12885_2"]
+        assert smn_calls[0][1] == smn_calls[1][1] == smn_caller.call(bam)
+        assert smn_caller.call_sample("NA12885", bam) == smn_calls[0][1]
+
+    def test_call_shares_pool(self):
+        expected_call = SmnCaller("37", region_file=region_file).call(bam)
+        with SmnCaller("37", threads=2, region_file=region_file) as smn_caller:
+            assert get_worker_pool() is None
+            pools = []
+            for _ in range(3):
+                assert smn_caller.call(bam) == expected_call
+                pools.append(get_worker_pool())
+            assert pools[0] is not None
+            assert all(pool is pools[0] for pool in pools)
+        assert get_worker_pool() is None
+
+    def test_genome(self):
+        with pytest.raises(Exception):
+            SmnCaller("36")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import os
+import gzip
+import struct
+import numpy as np
+
+# The BAM linear index has one entry per 16 kb window
+LINEAR_INDEX_SHIFT = 14
+# Approximate compressed size of a BGZF block. Counting reads in a region
+# decompresses at least one block.
+BGZF_BLOCK_BYTES = 20000
+# bin number of the pseudo-bin holding the offsets and read counts of a reference
+PSEUDO_BIN = 37450
+_parsed_indexes = {}
+
+
+def find_index_file(alignment_file):
+    """Return the path to the index of an alignment file, or None."""
+    if alignment_file.endswith("cram"):
+        candidates = [alignment_file + ".crai", alignment_file[:-5] + ".crai"]
+    else:
+        candidates = [
+            alignment_file + ".bai",
+            os.path.splitext(alignment_file)[0] + ".bai",
+        ]
+    for index_file in candidates:
+        if os.path.exists(index_file):
+            return index_file
+    return None
+
+
+def parse_bai(index_file):
+    """
+    Return the linear index of each reference in a bai file, as the compressed
+    file offset of the first read in each 16 kb window.
+    The offset of the end of the reference's data is appended to each array.
+    """
+    with open(index_file, "rb") as read_index:
+        data = read_index.read()
+    if data[:4] != b"BAI\x01":
+        raise Exception("%s is not a bai file." % index_file)
+    (n_ref,) = struct.unpack_from("<i", data, 4)
+    offset = 8
+    linear_index = []
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        data_end = 0
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            # The first chunk of the pseudo-bin holds the start and end offsets
+            # of the reference's data, the other bins are not needed.
+            if bin_id == PSEUDO_BIN and n_chunk > 0:
+                (ref_end,) = struct.unpack_from("<Q", data, offset + 8)
+                data_end = ref_end >> 16
+            offset += 16 * n_chunk
+        (n_intv,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        ioffsets = np.frombuffer(data, dtype="<u8", count=n_intv, offset=offset)
+        offset += 8 * n_intv
+        # empty windows are stored as zero by some writers
+        coffsets = np.maximum.accumulate((ioffsets >> 16).astype(np.int64))
+        data_end = max(data_end, coffsets.max(initial=0))
+        linear_index.append(np.append(coffsets, data_end))
+    return linear_index
+
+
+def parse_crai(index_file):
+    """
+    Return the slices listed in a crai file by reference id,
+    as arrays of start, end and compressed size.
+    """
+    slices = {}
+    with gzip.open(index_file, "rt") as read_index:
+        for line in read_index:
+            ref_id, start, span, _, _, size = [int(a) for a in line.split()]
+            slices.setdefault(ref_id, []).append((start - 1, start - 1 + span, size))
+    return {ref_id: np.array(slices[ref_id]).T for ref_id in slices}
+
+
+def load_index(index_file, parse_index):
+    """
+    Return the parsed index file. The last parsed index is kept and reused
+    as long as the file does not change.
+    """
+    index_stat = os.stat(index_file)
+    key = (os.path.abspath(index_file), index_stat.st_size, index_stat.st_mtime_ns)
+    if key not in _parsed_indexes:
+        _parsed_indexes.clear()
+        _parsed_indexes[key] = parse_index(index_file)
+    return _parsed_indexes[key]
+
+
+def get_region_costs(bamfile, regions):
+    """
+    Return the estimated cost of counting reads in each region, as the number
+    of compressed bytes the index assigns to it plus one block. Falls back to
+    region length when the index cannot be read.
+    """
+    region_lengths = [region[2] - region[1] for region in regions]
+    alignment_file = bamfile.filename.decode()
+    index_file = find_index_file(alignment_file)
+    if index_file is None:
+        return region_lengths
+    try:
+        if index_file.endswith("crai"):
+            slices = load_index(index_file, parse_crai)
+        else:
+            linear_index = load_index(index_file, parse_bai)
+    except Exception:
+        return region_lengths
+    costs = []
+    for region in regions:
+        ref_id = bamfile.get_tid(region[0])
+        if index_file.endswith("crai"):
+            region_bytes = 0
+            if ref_id in slices:
+                starts, ends, sizes = slices[ref_id]
+                overlapping = (starts < region[2]) & (ends > region[1])
+                region_bytes = int(sizes[overlapping].sum())
+        else:
+            region_bytes = 0
+            if 0 <= ref_id < len(linear_index):
+                coffsets = linear_index[ref_id]
+                last_window = min(
+                    (region[2] - 1) >> LINEAR_INDEX_SHIFT, len(coffsets) - 1
+                )
+                start_window = min(region[1] >> LINEAR_INDEX_SHIFT, last_window)
+                # Empty windows repeat the previous offset, so the data of the
+                # region ends where the offsets increase after its last window.
+                end_window = min(
+                    np.searchsorted(coffsets, coffsets[last_window], side="right"),
+                    len(coffsets) - 1,
+                )
+                region_bytes = int(coffsets[end_window] - coffsets[start_window])
+        costs.append(region_bytes + BGZF_BLOCK_BYTES)
+    return costs
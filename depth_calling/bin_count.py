@@ -20,25 +20,48 @@
 #
 #
 
+import os
+import json
 from collections import namedtuple, OrderedDict
 import multiprocessing as mp
 from functools import partial
-import pysam
 import numpy as np
-from statsmodels.nonparametric.smoothers_lowess import lowess
-from .utilities import open_alignment_file
+from .alignment_index import get_region_costs
+from .smoother import get_lowess_smoother, get_binned_smoother
+from .utilities import (
+    alignment_handle,
+    get_alignment_source,
+    get_worker_session,
+)
 
 
 MAD_CONSTANT = 1.4826
-
-
-def get_normed_depth(bamf, region_dic, nCores=1, reference=None, gc_correct=True):
+# Nearby regions are counted from one fetch when they are at most this far apart
+WINDOW_MAX_GAP = 10000
+WINDOW_MAX_SIZE = 1000000
+# Normalization regions are dispatched to workers in this many chunks per worker
+REGION_CHUNKS_PER_WORKER = 8
+
+depth_value = namedtuple("depth_value", "normalized mediandepth mad")
+
+
+def get_normed_depth(
+    bamf,
+    region_dic,
+    nCores=1,
+    reference=None,
+    gc_correct=True,
+    pool=None,
+    count_engine="pysam",
+    count_cache=None,
+    gc_engine="precomputed",
+):
     """
     Return the normalized depth values and coverage stats for a sample
     given a bam file
     """
     counts_for_normalization, gc_for_normalization, region_type_cn, read_length = count_reads_and_prepare_for_normalization(
-        bamf, region_dic, nCores, reference
+        bamf, region_dic, nCores, reference, pool, count_engine, count_cache
     )
     normed_depth = normalize(
         counts_for_normalization,
@@ -46,17 +69,32 @@ def get_normed_depth(bamf, region_dic, nCores=1, reference=None, gc_correct=True
         region_type_cn,
         read_length,
         gc_correct,
+        gc_engine,
     )
 
     return normed_depth
 
 
-def get_normed_depth_from_count(count_file, region_dic, read_length, gc_correct=True):
+def get_normed_depth_from_count(
+    count_file, region_dic, read_length, gc_correct=True, gc_engine="precomputed"
+):
     """
     Return the normalized depth values and coverage stats for a sample from
     a count file.
     """
     count_dic = get_count_from_file(count_file)
+    return get_normed_depth_from_count_dic(
+        count_dic, region_dic, read_length, gc_correct, gc_engine
+    )
+
+
+def get_normed_depth_from_count_dic(
+    count_dic, region_dic, read_length, gc_correct=True, gc_engine="precomputed"
+):
+    """
+    Return the normalized depth values and coverage stats for a sample from
+    the read counts of its regions, keyed by region name.
+    """
     counts_for_normalization, gc_for_normalization, region_type_cn = process_counts_and_prepare_for_normalization(
         count_dic, region_dic
     )
@@ -66,33 +104,72 @@ def get_normed_depth_from_count(count_file, region_dic, read_length, gc_correct=
         region_type_cn,
         read_length,
         gc_correct,
+        gc_engine,
     )
 
     return normed_depth
 
 
 def median_correction(counts):
-    """Return values corrected by median."""
-    y_counts = np.array(counts)
-    y_counts = y_counts / np.median(y_counts)
-    return y_counts
-
-
-def gc_correction(counts, gc, scale_coefficient=0.9):
-    """Return values corrected by GC content."""
-    y_counts = np.array(counts)
-    x_gc = np.array(gc)
-    y_counts = y_counts / np.median(y_counts)
-    value_lowess = lowess(y_counts, x_gc, return_sorted=False)
-    sample_median = np.median(y_counts)
-    gc_corrected = []
-    for i in range(len(y_counts)):
-        scale_factor = scale_coefficient * min(y_counts[i], 2)
-        gc_corrected.append(
-            y_counts[i] + scale_factor * (sample_median - value_lowess[i])
-        )
+    """
+    Return values corrected by median.
+    Each row of a samples x regions matrix is corrected by its own median.
+    """
+    y_counts = np.asarray(counts, dtype=float)
+    return y_counts / np.median(y_counts, axis=-1, keepdims=True)
+
+
+def get_lowess_fit(y_counts, x_gc):
+    """
+    Return the statsmodels LOWESS fit of counts against GC content.
+    Each row of a samples x regions matrix is fitted separately.
+    """
+    from statsmodels.nonparametric.smoothers_lowess import lowess
+
+    value_lowess = np.empty_like(y_counts)
+    for sample_counts, sample_lowess in zip(
+        y_counts.reshape(-1, len(x_gc)), value_lowess.reshape(-1, len(x_gc))
+    ):
+        sample_lowess[:] = lowess(sample_counts, x_gc, return_sorted=False)
+    return value_lowess
+
+
+def get_precomputed_lowess_fit(y_counts, x_gc):
+    """
+    Return the LOWESS fit of counts against GC content, with the neighborhoods
+    and weights of the GC values computed once for all samples.
+    """
+    return get_lowess_smoother(x_gc).smooth(y_counts)
+
+
+def get_binned_gc_fit(y_counts, x_gc):
+    """
+    Return the fit of counts against GC content interpolated between
+    the median counts of GC bins.
+    """
+    return get_binned_smoother(x_gc).smooth(y_counts)
+
+
+GC_ENGINES = {
+    "binned": get_binned_gc_fit,
+    "lowess": get_lowess_fit,
+    "precomputed": get_precomputed_lowess_fit,
+}
+
 
-    return gc_corrected
+def gc_correction(counts, gc, scale_coefficient=0.9, gc_engine="precomputed"):
+    """
+    Return values corrected by GC content.
+    Each row of a samples x regions matrix is corrected separately.
+    """
+    if gc_engine not in GC_ENGINES:
+        raise Exception("GC correction engine %s is not recognized." % gc_engine)
+    y_counts = median_correction(counts)
+    x_gc = np.asarray(gc, dtype=float)
+    value_lowess = GC_ENGINES[gc_engine](y_counts, x_gc)
+    sample_median = np.median(y_counts, axis=-1, keepdims=True)
+    scale_factor = scale_coefficient * np.minimum(y_counts, 2)
+    return y_counts + scale_factor * (sample_median - value_lowess)
 
 
 def get_read_count(bamfile, region, mapq_cutoff=0):
@@ -115,10 +192,82 @@ def get_read_count(bamfile, region, mapq_cutoff=0):
     return nreads
 
 
-def mad(list_of_number):
+def group_regions_into_windows(
+    regions, max_gap=WINDOW_MAX_GAP, max_size=WINDOW_MAX_SIZE
+):
+    """
+    Return windows of nearby regions as (chromosome, indexes of the regions).
+    Regions within a window are sorted by position and do not overlap.
+    """
+    order = sorted(range(len(regions)), key=lambda i: tuple(regions[i][:3]))
+    windows = []
+    window_start = window_end = None
+    for i in order:
+        nchr, region_start, region_end = regions[i][:3]
+        if (
+            windows != []
+            and windows[-1][0] == nchr
+            and window_end <= region_start <= window_end + max_gap
+            and region_end - window_start <= max_size
+        ):
+            windows[-1][1].append(i)
+        else:
+            windows.append((nchr, [i]))
+            window_start = region_start
+        window_end = region_end
+    return windows
+
+
+def get_read_counts_windowed(bamfile, regions, mapq_cutoff=0):
+    """
+    Return the number of reads that align to each region, fetching each
+    window of nearby regions once.
+    Reads are assigned to regions by their start position, with the same
+    rules as get_read_count.
+    """
+    counts = [0] * len(regions)
+    for nchr, window in group_regions_into_windows(regions):
+        region_starts = np.array([regions[i][1] for i in window])
+        region_ends = np.array([regions[i][2] for i in window])
+        read_starts = np.fromiter(
+            (
+                read.reference_start
+                for read in bamfile.fetch(nchr, region_starts[0], region_ends[-1])
+                if read.mapping_quality >= mapq_cutoff and read.flag & 0x900 == 0
+            ),
+            dtype=np.int64,
+        )
+        region_index = np.searchsorted(region_starts, read_starts, side="right") - 1
+        in_region = (region_index >= 0) & (
+            read_starts < region_ends[np.maximum(region_index, 0)]
+        )
+        window_counts = np.bincount(region_index[in_region], minlength=len(window))
+        for i, nreads in zip(window, window_counts):
+            counts[i] = int(nreads)
+    return counts
+
+
+READ_COUNT_ENGINES = {"pysam": get_read_count}
+# Engines that count a whole list of regions at once
+REGION_LIST_COUNT_ENGINES = {"window": get_read_counts_windowed}
+COUNT_ENGINES = sorted(list(READ_COUNT_ENGINES) + list(REGION_LIST_COUNT_ENGINES))
+
+
+def get_read_counts(bamfile, regions, count_engine="pysam", mapq_cutoff=0):
+    """Return the number of reads that align to each region in a list."""
+    if count_engine in REGION_LIST_COUNT_ENGINES:
+        return REGION_LIST_COUNT_ENGINES[count_engine](bamfile, regions, mapq_cutoff)
+    if count_engine not in READ_COUNT_ENGINES:
+        raise Exception("Read counting engine %s is not recognized." % count_engine)
+    read_count = READ_COUNT_ENGINES[count_engine]
+    return [read_count(bamfile, region, mapq_cutoff) for region in regions]
+
+
+def mad(list_of_number, axis=-1):
     """Return the median of absolute deviation."""
-    med = np.median(list_of_number)
-    return MAD_CONSTANT * np.median([abs(a - med) for a in list_of_number])
+    values = np.asarray(list_of_number)
+    med = np.median(values, axis=axis, keepdims=True)
+    return MAD_CONSTANT * np.median(np.abs(values - med), axis=axis)
 
 
 def normalize(
@@ -127,32 +276,67 @@ def normalize(
     region_type_cn,
     read_length,
     gc_correct,
+    gc_engine="precomputed",
 ):
     """
     Return the normalized depth values for a sample.
     Median normalization and/or GC normalization
     """
-    gc_corrected_depth = gc_correction(counts_for_normalization, gc_for_normalization)
+    return normalize_samples(
+        [counts_for_normalization],
+        gc_for_normalization,
+        region_type_cn,
+        [read_length],
+        gc_correct,
+        gc_engine,
+    )[0]
+
+
+def normalize_samples(
+    count_matrix,
+    gc_for_normalization,
+    region_type_cn,
+    read_lengths,
+    gc_correct,
+    gc_engine="precomputed",
+):
+    """
+    Return the normalized depth values for a samples x regions matrix of counts
+    of the same regions, one result per sample.
+    Median normalization and/or GC normalization
+    """
+    count_matrix = np.asarray(count_matrix, dtype=float)
+    gc_corrected_depth = gc_correction(
+        count_matrix, gc_for_normalization, gc_engine=gc_engine
+    )
     if gc_correct is True:
         # GC normalization
         corrected_depth = gc_corrected_depth
     else:
         # Median normalization
-        corrected_depth = median_correction(counts_for_normalization)
-
-    vmedian = np.median(counts_for_normalization) * read_length
-    vmad = round(mad(gc_corrected_depth) / np.median(gc_corrected_depth), 3)
+        corrected_depth = median_correction(count_matrix)
 
-    # Also return median depth of this sample and the coverage MAD.
-    norm_count = {}
-    for i, (region_type, hap_cn) in enumerate(region_type_cn.items()):
-        if vmedian == 0:
-            norm_count.setdefault(region_type, None)
-        else:
-            norm_count.setdefault(region_type, 2 * hap_cn * corrected_depth[i])
-    depth_value = namedtuple("depth_value", "normalized mediandepth mad")
-    normalized_bin = depth_value(norm_count, vmedian, vmad)
-    return normalized_bin
+    vmedian = np.median(count_matrix, axis=1) * np.asarray(read_lengths, dtype=float)
+    vmad = np.round(
+        mad(gc_corrected_depth, axis=1) / np.median(gc_corrected_depth, axis=1), 3
+    )
+    # The regions of each region type come first
+    hap_cn = np.array(list(region_type_cn.values()))
+    region_type_depth = 2 * hap_cn * corrected_depth[:, : len(region_type_cn)]
+
+    # Also return median depth of each sample and the coverage MAD.
+    normalized_bins = []
+    for sample_median, sample_mad, sample_depth in zip(
+        vmedian, vmad, region_type_depth
+    ):
+        norm_count = {}
+        for region_type, depth in zip(region_type_cn, sample_depth):
+            if sample_median == 0:
+                norm_count.setdefault(region_type, None)
+            else:
+                norm_count.setdefault(region_type, depth)
+        normalized_bins.append(depth_value(norm_count, sample_median, sample_mad))
+    return normalized_bins
 
 
 def get_read_length(reads, number_to_count=2000):
@@ -167,76 +351,183 @@ def get_read_length(reads, number_to_count=2000):
     return np.median(read_length)
 
 
+def get_region_counts(
+    bamf, region_dic, nCores=1, reference=None, pool=None, count_engine="pysam"
+):
+    """
+    Return the read counts of all regions, keyed by region name,
+    and the read length for a sample given a bam file or an open alignment session.
+    Normalization regions are counted in the given worker pool if there is one,
+    otherwise in a pool created for this sample.
+    """
+    with alignment_handle(bamf, reference) as bamfile:
+        # Store read counts in each interval
+        count_dic = OrderedDict()
+        for region_type in region_dic:
+            if region_type != "norm":
+                lregion = [a[0] for a in region_dic[region_type]]
+                lcount = get_read_counts(bamfile, lregion, count_engine)
+                for region, num_reads in zip(lregion, lcount):
+                    count_dic.setdefault(region[3], num_reads)
+
+        # Get read length from the last region
+        region = lregion[-1]
+        reads = bamfile.fetch(region[0], region[1], region[2])
+        read_length = get_read_length(reads)
+
+        lregion = [a[0] for a in region_dic["norm"]]
+        if pool is None and nCores <= 1:
+            # Count with the handle that is already open
+            region_groups = partition_by_cost(lregion, 1, [1] * len(lregion))
+            result = [
+                count_normalization_regions(
+                    bamfile, [lregion[i] for i in region_group], count_engine
+                )
+                for region_group in region_groups
+            ]
+        else:
+            # Small contiguous chunks are handed out to workers as they become
+            # free, largest first, so that a slow chunk does not hold up a sample.
+            region_costs = get_region_costs(bamfile, lregion)
+            region_groups = partition_by_cost(
+                lregion, nCores * REGION_CHUNKS_PER_WORKER, region_costs
+            )
+            bam_path, reference = get_alignment_source(bamf, reference)
+            get_normed_depth_bam = partial(
+                get_indexed_normalization_region_values,
+                bam=bam_path,
+                reference=reference,
+                count_engine=count_engine,
+            )
+            region_lists = sorted(
+                [
+                    (j, [lregion[i] for i in region_group])
+                    for j, region_group in enumerate(region_groups)
+                ],
+                key=lambda a: -sum(region_costs[i] for i in region_groups[a[0]]),
+            )
+            if pool is not None:
+                result = dict(pool.imap_unordered(get_normed_depth_bam, region_lists))
+            else:
+                with mp.Pool(nCores) as sample_pool:
+                    result = dict(
+                        sample_pool.imap_unordered(get_normed_depth_bam, region_lists)
+                    )
+            result = [result[j] for j in range(len(region_groups))]
+        # Keep the order of the region file
+        region_values = [None] * len(lregion)
+        for region_group, result_group in zip(region_groups, result):
+            for i, num_reads in zip(region_group, result_group):
+                region_values[i] = num_reads
+        for region, num_reads in zip(lregion, region_values):
+            count_dic.setdefault(region[3], num_reads)
+
+    return count_dic, read_length
+
+
 def count_reads_and_prepare_for_normalization(
-    bamf, region_dic, nCores=1, reference=None
+    bamf,
+    region_dic,
+    nCores=1,
+    reference=None,
+    pool=None,
+    count_engine="pysam",
+    count_cache=None,
 ):
     """
     Return the normalized depth values and coverage stats for a sample
-    given a bam file
+    given a bam file or an open alignment session.
+    Counts found in the count cache are used without reading the alignment file.
     """
-    bamfile = open_alignment_file(bamf, reference)
-    # Store read counts in each interval
-    counts_for_normalization = []
-    gc_for_normalization = []
-    region_type_cn = OrderedDict()
-    for region_type in region_dic:
-        if region_type != "norm":
-            lcount = []
-            region_length = None
-            hap_cn = None
-            for (region, gc) in region_dic[region_type]:
-                region_reads = get_read_count(bamfile, region)
-                lcount.append(region_reads)
-                if "_hapcn" in region[3]:
-                    region_length = region[2] - region[1]
-                    gc_for_normalization.append(float(gc))
-                    hap_cn = int(region[3].split("hapcn")[1])
-            if region_length is None or hap_cn is None:
-                raise Exception("Problem with region definition. Length not specified.")
-            count_sum = sum(lcount)
-            counts_for_normalization.append(count_sum / (hap_cn * region_length))
-            region_type_cn.setdefault(region_type, hap_cn)
+    cached_counts = None
+    if count_cache is not None:
+        bam_path, _ = get_alignment_source(bamf, reference)
+        cached_counts = count_cache.get(bam_path, region_dic)
+    if cached_counts is not None:
+        count_dic, read_length = cached_counts
+    else:
+        count_dic, read_length = get_region_counts(
+            bamf, region_dic, nCores, reference, pool, count_engine
+        )
+        if count_cache is not None:
+            count_cache.put(bam_path, region_dic, count_dic, read_length)
+    counts_for_normalization, gc_for_normalization, region_type_cn = process_counts_and_prepare_for_normalization(
+        count_dic, region_dic
+    )
+    return counts_for_normalization, gc_for_normalization, region_type_cn, read_length
 
-    # Get read length from the last region
-    reads = bamfile.fetch(region[0], region[1], region[2])
-    read_length = get_read_length(reads)
 
-    lregion = [
-        (region[0], region[1], region[2], gc) for (region, gc) in region_dic["norm"]
-    ]
-    get_normed_depth_bam = partial(
-        get_normalization_region_values, bam=bamf, reference=reference
-    )
-    region_groups = partition(lregion, nCores)
-    pool = mp.Pool(nCores)
-    result = pool.map(get_normed_depth_bam, region_groups)
-    for result_group in result:
-        for region_out in result_group:
-            counts_for_normalization.append(region_out[0])
-            gc_for_normalization.append(region_out[1])
+def partition_by_cost(lst, n, costs):
+    """
+    Partition a list of regions into at most n groups of coordinate-sorted,
+    contiguous regions with similar total cost.
+    A region starts a new group if more than half of its cost would fall
+    past the current group's share of the total.
+    Return the indexes of the regions in each group.
+    """
+    order = sorted(range(len(lst)), key=lambda i: tuple(lst[i][:3]))
+    total_cost = float(sum(costs))
+    groups = [[]]
+    cumulative_cost = 0
+    for i in order:
+        if (
+            groups[-1] != []
+            and len(groups) < n
+            and cumulative_cost + costs[i] / 2 > total_cost * len(groups) / n
+        ):
+            groups.append([])
+        groups[-1].append(i)
+        cumulative_cost += costs[i]
+    return groups
 
-    bamfile.close()
 
-    return counts_for_normalization, gc_for_normalization, region_type_cn, read_length
+def count_normalization_regions(bamfile, l, count_engine="pysam"):
+    """Perform read counting in a list of regions with an open alignment file."""
+    return get_read_counts(bamfile, l, count_engine)
+
+
+def get_normalization_region_values(l, bam, reference=None, count_engine="pysam"):
+    """
+    Perform read counting in a list of regions.
+    Run in pool workers, which keep the alignment file open between tasks.
+    """
+    bamfile = get_worker_session(bam, reference).handle
+    return count_normalization_regions(bamfile, l, count_engine)
 
 
-def partition(lst, n):
-    """Partion a list"""
-    return [lst[i::n] for i in range(n)]
+def get_indexed_normalization_region_values(
+    indexed_regions, bam, reference=None, count_engine="pysam"
+):
+    """
+    Perform read counting in a numbered list of regions and return the number
+    with the values, so that results can be collected in any order.
+    """
+    index, l = indexed_regions
+    return index, get_normalization_region_values(l, bam, reference, count_engine)
 
 
-def get_normalization_region_values(l, bam, reference=None):
-    """Perform read counting in a list of regions."""
-    bamfile = open_alignment_file(bam, reference)
-    lcount = []
-    for region in l:
-        num_reads = get_read_count(bamfile, region)
-        region_length = int(region[2]) - int(region[1])
-        norm_depth = num_reads / region_length
-        region_gc = float(region[-1])
-        lcount.append((norm_depth, region_gc))
-    bamfile.close()
-    return lcount
+def write_count_file(count_file, region_dic, count_dic, count_meta=None):
+    """
+    Write region read counts in the format read by get_count_from_file.
+    Values in count_meta, such as the read length, are written first on
+    lines starting with # and are read back by get_count_meta_from_file.
+    The file is written under a temporary name and moved into place when complete.
+    """
+    tmp_count_file = count_file + ".tmp"
+    with open(tmp_count_file, "w") as count_output:
+        if count_meta is not None:
+            for key, value in count_meta.items():
+                count_output.write("#%s\t%s\n" % (key, json.dumps(value)))
+        for region_type in region_dic:
+            for (region, gc) in region_dic[region_type]:
+                count_output.write(
+                    "\t".join(
+                        [region[0], str(region[1]), str(region[2]), region[3]]
+                        + [str(count_dic[region[3]])]
+                    )
+                    + "\n"
+                )
+    os.replace(tmp_count_file, count_file)
 
 
 def get_count_from_file(count_file):
@@ -244,11 +535,28 @@ def get_count_from_file(count_file):
     count_dic = {}
     with open(count_file) as f:
         for line in f:
+            if line.startswith("#"):
+                continue
             at = line.strip().split()
             count_dic.setdefault(at[3], int(at[-1]))
     return count_dic
 
 
+def get_count_meta_from_file(count_file):
+    """
+    Return the values stored on # lines of a count file, keyed by name.
+    Count files without such lines return an empty dictionary.
+    """
+    count_meta = {}
+    with open(count_file) as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            key, value = line[1:].rstrip("\n").split("\t", 1)
+            count_meta[key] = json.loads(value)
+    return count_meta
+
+
 def process_counts_and_prepare_for_normalization(count_dic, region_dic):
     """
     Return the normalized depth values and coverage stats for a sample from
@@ -277,6 +585,6 @@ def process_counts_and_prepare_for_normalization(count_dic, region_dic):
     for (region, gc) in region_dic["norm"]:
         region_length = int(region[2]) - int(region[1])
         counts_for_normalization.append(count_dic[region[3]] / region_length)
-        gc_for_normalization.append(gc)
+        gc_for_normalization.append(float(gc))
 
     return counts_for_normalization, gc_for_normalization, region_type_cn
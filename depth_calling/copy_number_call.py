@@ -20,7 +20,8 @@
 #
 #
 
-from scipy.stats import poisson
+import numpy as np
+from .numerics import poisson_pmf
 
 POSTERIOR_CUTOFF_STRINGENT = 0.9
 ERROR_RATE = 0.01
@@ -46,9 +47,9 @@ def call_reg1_cn(full_cn, count_reg1, count_reg2, min_read=0):
         if i == full_cn:
             depthexpected = float(nsum) - ERROR_RATE * float(nsum)
         if count_reg1 <= count_reg2:
-            prob.append(poisson.pmf(count_reg1, depthexpected))
+            prob.append(poisson_pmf(count_reg1, depthexpected))
         else:
-            prob.append(poisson.pmf(count_reg2, depthexpected))
+            prob.append(poisson_pmf(count_reg2, depthexpected))
 
     sum_prob = sum(prob)
     if sum_prob == 0:
@@ -75,6 +76,73 @@ def call_reg1_cn(full_cn, count_reg1, count_reg2, min_read=0):
     return cn_prob_filtered
 
 
+def get_reg1_log_likelihood(full_cn, counts_reg1, counts_reg2):
+    """
+    Return the Poisson log likelihood of each reg1 copy number (columns)
+    at each site (rows), up to a per-site constant.
+    The log-factorial term is shared by all copy numbers at a site
+    and cancels out when the posterior is normalized.
+    """
+    nsum = counts_reg1 + counts_reg2
+    minor_count = np.minimum(counts_reg1, counts_reg2)
+    fraction = np.arange(full_cn + 1, dtype=float) / float(full_cn)
+    fraction[0] = ERROR_RATE / 3
+    fraction[-1] = 1 - ERROR_RATE
+    depthexpected = nsum[:, np.newaxis] * fraction
+    return minor_count[:, np.newaxis] * np.log(depthexpected) - depthexpected
+
+
+def call_reg1_cn_batch(full_cn, counts_reg1, counts_reg2, min_read=0):
+    """
+    Return the reg1 copy number calls for a list of sites, as call_reg1_cn
+    does for a single site.
+    The posterior is normalized in log space so that it does not underflow
+    at high depth.
+    """
+    num_sites = len(counts_reg1)
+    if full_cn is None:
+        return [[None] for _ in range(num_sites)]
+    if full_cn == 0:
+        return [[0] for _ in range(num_sites)]
+    counts_reg1 = np.asarray(counts_reg1, dtype=float)
+    counts_reg2 = np.asarray(counts_reg2, dtype=float)
+    has_reads = counts_reg1 + counts_reg2 > 0
+    log_prob = get_reg1_log_likelihood(
+        full_cn, counts_reg1[has_reads], counts_reg2[has_reads]
+    )
+    log_prob -= log_prob.max(axis=1, keepdims=True)
+    prob = np.exp(log_prob)
+    post_prob = prob / prob.sum(axis=1, keepdims=True)
+    reverse = counts_reg2[has_reads] < counts_reg1[has_reads]
+    post_prob[reverse] = post_prob[reverse, ::-1]
+
+    lcalls = [[None] for _ in range(num_sites)]
+    for row, site_index in enumerate(np.flatnonzero(has_reads)):
+        site_prob = post_prob[row]
+        order = np.argsort(-site_prob, kind="stable")
+        best_prob = float(site_prob[order[0]])
+        best_cn = int(order[0])
+        if (
+            best_cn != 0
+            and counts_reg1[site_index] <= min_read
+            and counts_reg2[site_index] >= min_read
+        ):
+            lcalls[site_index] = [0]
+        elif best_prob >= POSTERIOR_CUTOFF_STRINGENT:
+            lcalls[site_index] = [best_cn]
+        else:
+            # output the two most likely scenarios
+            second_prob = float(site_prob[order[1]])
+            second_cn = int(np.argmax(site_prob == second_prob))
+            lcalls[site_index] = [
+                best_cn,
+                round(best_prob, 3),
+                second_cn,
+                round(second_prob, 3),
+            ]
+    return lcalls
+
+
 def process_raw_call_gc(cn_prob, post_cutoff, keep_none=True):
     """
     Filter raw CN calls based on posterior probablity cutoff.
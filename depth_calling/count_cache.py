@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+# Bump when the cached values or their layout change
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".npz"
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+def get_region_names(region_dic):
+    """Return the region names in region file order."""
+    return [
+        region[3]
+        for region_type in region_dic
+        for (region, gc) in region_dic[region_type]
+    ]
+
+
+def get_region_hash(region_dic):
+    """Return a hash of the region definitions."""
+    region_hash = hashlib.sha1()
+    for region_type in region_dic:
+        for (region, gc) in region_dic[region_type]:
+            region_hash.update(
+                ("\t".join(str(a) for a in region + (region_type,)) + "\n").encode()
+            )
+    return region_hash.hexdigest()
+
+
+class CountCache:
+    """
+    An on-disk cache of the region read counts and read length of alignment files.
+    Entries are keyed by the alignment file path, size and modification time
+    and by the region definitions. The least recently used entries are removed
+    when the cache grows beyond max_size bytes.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_path(self, alignment_file, region_dic):
+        """Return the path of the cache entry of an alignment file."""
+        alignment_file = os.path.abspath(alignment_file)
+        file_stat = os.stat(alignment_file)
+        key = "\t".join(
+            [
+                str(CACHE_VERSION),
+                alignment_file,
+                str(file_stat.st_size),
+                str(file_stat.st_mtime_ns),
+                get_region_hash(region_dic),
+            ]
+        )
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + CACHE_SUFFIX
+        )
+
+    def get(self, alignment_file, region_dic):
+        """
+        Return the cached region counts, keyed by region name, and read length
+        of an alignment file, or None if they are not in the cache.
+        """
+        entry = self.get_path(alignment_file, region_dic)
+        try:
+            with np.load(entry) as cached:
+                counts = cached["counts"]
+                read_length = float(cached["read_length"])
+        except (OSError, ValueError, KeyError):
+            return None
+        region_names = get_region_names(region_dic)
+        if len(counts) != len(region_names):
+            return None
+        try:
+            # Mark the entry as recently used
+            os.utime(entry)
+        except OSError:
+            pass
+        count_dic = dict(zip(region_names, counts.tolist()))
+        return count_dic, read_length
+
+    def put(self, alignment_file, region_dic, count_dic, read_length):
+        """Store the region counts and read length of an alignment file."""
+        entry = self.get_path(alignment_file, region_dic)
+        counts = np.array(
+            [count_dic[name] for name in get_region_names(region_dic)], dtype=np.int64
+        )
+        # Write to a temporary file first so that readers never see partial entries
+        tmp_fd, tmp_entry = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(tmp_fd, "wb") as cache_output:
+                np.savez(cache_output, counts=counts, read_length=read_length)
+            os.replace(tmp_entry, entry)
+        except BaseException:
+            os.remove(tmp_entry)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits max_size."""
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(CACHE_SUFFIX):
+                try:
+                    file_stat = os.stat(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    continue
+                entries.append((file_stat.st_mtime_ns, file_stat.st_size, file_name))
+        cache_size = sum(a[1] for a in entries)
+        for _, entry_size, file_name in sorted(entries):
+            if cache_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                # Already removed by another process
+                pass
+            cache_size -= entry_size
@@ -23,7 +23,7 @@
 from collections import namedtuple
 import math
 import numpy as np
-from scipy.stats import norm
+from .numerics import norm_pdf, norm_cdf, norm_pdf_array, norm_cdf_array
 
 # sd for CN=0 is arbitrarily set at 0.032
 SIGMA_CN0 = 0.032
@@ -31,6 +31,7 @@ PV_CUTOFF = 1e-3
 POSTERIOR_CUTOFF = 0.95
 # CN = 0 - 10
 DEFAULT_GMM_NSTATE = 11
+gmm_batch_call = namedtuple("gmm_batch_call", "cn depth_value post_prob p_value")
 
 
 class Gmm:
@@ -108,8 +109,8 @@ class Gmm:
     def get_gauss_pmf_cdf(self, test_value, gauss_mean, gauss_sd):
         """Return the pmf and cdf of a gaussian distribution."""
         test_stats = (test_value - gauss_mean) / gauss_sd
-        pdf = norm.pdf(test_stats) / gauss_sd
-        p_value = min(norm.cdf(test_stats), 1 - norm.cdf(test_stats))
+        pdf = norm_pdf(test_stats) / gauss_sd
+        p_value = min(norm_cdf(test_stats), 1 - norm_cdf(test_stats))
         return (pdf, p_value)
 
     def call_post_prob(self, val, post_cutoff):
@@ -128,3 +129,39 @@ class Gmm:
             return post_prob.index(max_prob)
         else:
             return None
+
+    def gmm_call_batch(self, values):
+        """
+        Return the copy number calls of an array of depth values, e.g. of a cohort.
+        Also return the posterior probability of each state for each value and
+        the p-value of the state with the highest posterior probability.
+        """
+        values = np.asarray(values, dtype=float)
+        val_new = (values / 2) / self.value_shift
+        post_prob = self.get_post_prob_batch(val_new)
+        max_state = np.argmax(np.where(np.isnan(post_prob), -1, post_prob), axis=1)
+        has_call = np.max(post_prob, axis=1) >= POSTERIOR_CUTOFF
+        test_stats = (val_new - np.take(self.mu_state, max_state)) / np.take(
+            self.sigma_state, max_state
+        )
+        test_cdf = norm_cdf_array(test_stats)
+        p_value = np.minimum(test_cdf, 1 - test_cdf)
+        # apply another p-value cutoff
+        # just comparing the depth value and the called CN
+        has_call &= p_value >= PV_CUTOFF
+        cn = [int(a) if b else None for a, b in zip(max_state, has_call)]
+        return gmm_batch_call(
+            cn, np.round(values / self.value_shift, 3), post_prob, p_value
+        )
+
+    def get_post_prob_batch(self, values):
+        """
+        Return the posterior probability of each state for an array of values,
+        as a values x states matrix.
+        """
+        mu_state = np.array(self.mu_state)
+        sigma_state = np.array(self.sigma_state)
+        test_stats = (values[:, np.newaxis] - mu_state) / sigma_state
+        prob = norm_pdf_array(test_stats) / sigma_state * np.array(self.prior_state)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return prob / np.sum(prob, axis=1, keepdims=True)
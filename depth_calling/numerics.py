@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+
+import math
+import numpy as np
+
+SQRT_2 = math.sqrt(2)
+SQRT_2PI = math.sqrt(2 * math.pi)
+# log(k!) is looked up for counts below this and computed with lgamma above it
+LOG_FACTORIAL_TABLE_SIZE = 4096
+LOG_FACTORIAL = np.concatenate(
+    ([0.0], np.cumsum(np.log(np.arange(1, LOG_FACTORIAL_TABLE_SIZE))))
+)
+_erfc = np.vectorize(math.erfc, otypes=[float])
+
+
+def norm_pdf(x):
+    """Return the standard normal pdf at a number."""
+    return math.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def norm_cdf(x):
+    """Return the standard normal cdf at a number."""
+    return 0.5 * math.erfc(-x / SQRT_2)
+
+
+def norm_pdf_array(x):
+    """Return the standard normal pdf at each value of an array."""
+    x = np.asarray(x, dtype=float)
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def norm_cdf_array(x):
+    """Return the standard normal cdf at each value of an array."""
+    return 0.5 * _erfc(-np.asarray(x, dtype=float) / SQRT_2)
+
+
+def log_factorial(k):
+    """Return log(k!) for a non-negative integer count."""
+    if k < LOG_FACTORIAL_TABLE_SIZE:
+        return float(LOG_FACTORIAL[int(k)])
+    return math.lgamma(k + 1)
+
+
+def xlogy(x, y):
+    """Return x * log(y) for arrays, with 0 where x is 0."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(x == 0, 0.0, x * np.log(y))
+
+
+def poisson_logpmf(k, mu):
+    """Return the Poisson log pmf of a count k with mean mu."""
+    if mu == 0:
+        return 0.0 if k == 0 else -math.inf
+    return k * math.log(mu) - mu - log_factorial(k)
+
+
+def poisson_pmf(k, mu):
+    """Return the Poisson pmf of a count k with mean mu."""
+    return math.exp(poisson_logpmf(k, mu))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import math
+import heapq
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes are replaced after this many tasks to keep memory in check
+MAX_TASKS_PER_CHILD = 100
+_worker_pool = None
+
+
+def split_threads(threads, num_samples, sample_workers=None):
+    """
+    Return the number of samples to process at the same time and the number
+    of region counting workers per sample, given the total thread budget.
+    By default the budget is split evenly, e.g. 64 threads -> 8 x 8.
+    """
+    threads = max(1, threads)
+    if sample_workers is None:
+        sample_workers = int(math.sqrt(threads))
+    sample_workers = max(1, min(sample_workers, threads, num_samples))
+    region_workers = max(1, threads // sample_workers)
+    return sample_workers, region_workers
+
+
+def partition_by_size(sizes, n):
+    """
+    Partition items into n groups of similar total size by giving each item,
+    largest first, to the group with the smallest total so far.
+    Ties are broken by index, so the same sizes always give the same groups.
+    Return the sorted indexes of the items in each group.
+    """
+    groups = [[] for _ in range(n)]
+    group_sizes = [(0, i) for i in range(n)]
+    for index in sorted(range(len(sizes)), key=lambda i: (-sizes[i], i)):
+        group_size, group = heapq.heappop(group_sizes)
+        groups[group].append(index)
+        heapq.heappush(group_sizes, (group_size + sizes[index], group))
+    return [sorted(group) for group in groups]
+
+
+def start_worker_pool(processes, maxtasksperchild=MAX_TASKS_PER_CHILD):
+    """
+    Start the region counting pool shared by all samples processed in this
+    process. No pool is started for a single worker.
+    """
+    global _worker_pool
+    stop_worker_pool()
+    if processes > 1:
+        _worker_pool = mp.Pool(processes, maxtasksperchild=maxtasksperchild)
+    return _worker_pool
+
+
+def get_worker_pool():
+    """Return the region counting pool of this process, or None."""
+    return _worker_pool
+
+
+def stop_worker_pool():
+    """Shut down the region counting pool and wait for its workers to exit."""
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool.join()
+        _worker_pool = None
+
+
+def init_sample_worker(region_workers, maxtasksperchild=MAX_TASKS_PER_CHILD):
+    """Start the region counting pool of a sample worker process."""
+    start_worker_pool(region_workers, maxtasksperchild)
+    # Run before the pool's own finalizer so that workers exit cleanly.
+    mp.util.Finalize(None, stop_worker_pool, exitpriority=20)
+
+
+def run_samples(process_sample, samples, sample_workers=1, region_workers=1):
+    """
+    Apply process_sample to each sample and yield the results
+    in the same order as the input samples.
+    Each process handling samples keeps one region counting pool
+    with region_workers workers for the whole run. No pool is started
+    for a single region worker.
+    """
+    if sample_workers <= 1:
+        if region_workers > 1:
+            start_worker_pool(region_workers)
+        try:
+            for sample in samples:
+                yield process_sample(sample)
+        finally:
+            stop_worker_pool()
+    else:
+        initializer = init_sample_worker if region_workers > 1 else None
+        with ProcessPoolExecutor(
+            sample_workers, initializer=initializer, initargs=(region_workers,)
+        ) as executor:
+            for result in executor.map(process_sample, samples):
+                yield result
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import numpy as np
+
+# Number of GC bins of the binned fit, with similar numbers of regions each
+GC_BINS = 20
+# Fewer bins are used so that each bin has at least this many regions
+GC_BIN_MIN_REGIONS = 100
+
+_smoothers = {}
+
+
+class LowessSmoother:
+    """
+    LOWESS smoothing of values that share the same x values, such as the
+    depth of all samples against the GC content of the same regions.
+    This follows statsmodels lowess with delta=0. The neighborhoods and
+    tricube weights only depend on x and are computed once, so that smoothing
+    a sample, including the robustness iterations, is a few matrix products
+    with precomputed weights.
+    """
+
+    def __init__(self, x, frac=2.0 / 3.0, it=3):
+        self.x = np.array(x, dtype=float)
+        self.it = it
+        n = len(self.x)
+        # Use the same sort as statsmodels so that ties are ordered the same way
+        self.sort_index = np.argsort(self.x)
+        x_sorted = self.x[self.sort_index]
+        k = min(max(int(frac * n + 1e-10), 2), n)
+        # Points with the same x share the fit of the first of them
+        new_value = np.ones(n, dtype=bool)
+        new_value[1:] = x_sorted[1:] != x_sorted[:-1]
+        self.fit_index = np.flatnonzero(new_value)
+        self.fit_group = np.cumsum(new_value) - 1
+        xval = x_sorted[self.fit_index]
+        # Neighborhoods of k points slide right while xval is closer to the
+        # point after the neighborhood than to its first point
+        mid_points = (x_sorted[: n - k] + x_sorted[k:]) / 2.0
+        left_end = np.searchsorted(mid_points, xval, side="left")
+        window_index = left_end[:, np.newaxis] + np.arange(k)
+        x_window = x_sorted[window_index]
+        radius = np.fmax(xval - x_window[:, 0], x_window[:, -1] - xval)
+        # Fall back to statsmodels for degenerate neighborhoods
+        self.is_valid = bool(np.all(np.isfinite(x_sorted)) and np.all(radius > 0))
+        if not self.is_valid:
+            return
+        # Tricube weights of every neighborhood, and the weights times the
+        # distance to the fitted point and its square, as regions x points matrices
+        x_dist = x_window - xval[:, np.newaxis]
+        dist = np.abs(x_dist) / radius[:, np.newaxis]
+        tricube = 1.0 - dist * dist * dist
+        tricube = tricube * tricube * tricube
+        self.tricube = np.zeros((len(xval), n))
+        np.put_along_axis(self.tricube, window_index, tricube, axis=1)
+        self.tricube_dist = np.zeros((len(xval), n))
+        np.put_along_axis(self.tricube_dist, window_index, tricube * x_dist, axis=1)
+        self.tricube_sqdist = np.zeros((len(xval), n))
+        np.put_along_axis(
+            self.tricube_sqdist, window_index, tricube * x_dist * x_dist, axis=1
+        )
+        # Points that keep a weight above 1e-12 when their robustness weight
+        # is above 1e-6, to find fits with too few weighted points
+        self.is_weighted = (self.tricube > 1e-6).astype(np.float32)
+
+    def fit(self, y_sorted, resid_weights):
+        """Return one weighted local linear fit of rows of sorted y values."""
+        weighted_y = resid_weights * y_sorted
+        sum_weights = resid_weights @ self.tricube.T
+        sum_dist = resid_weights @ self.tricube_dist.T
+        sum_sqdist = resid_weights @ self.tricube_sqdist.T
+        sum_y = weighted_y @ self.tricube.T
+        sum_dist_y = weighted_y @ self.tricube_dist.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Weighted mean and variance of x, relative to the fitted point
+            mean_dist = sum_dist / sum_weights
+            mean_y = sum_y / sum_weights
+            weighted_sqdev_x = np.fmax(
+                sum_sqdist / sum_weights - mean_dist * mean_dist, 1e-12
+            )
+            y_fit = (
+                mean_y
+                - mean_dist * (sum_dist_y / sum_weights - mean_dist * mean_y)
+                / weighted_sqdev_x
+            )
+        # Points without enough weight keep their own value
+        num_weighted = (resid_weights > 1e-6).astype(np.float32) @ self.is_weighted.T
+        for sample, i in zip(*np.nonzero(num_weighted < 2)):
+            tricube = self.tricube[i]
+            if np.count_nonzero(tricube * resid_weights[sample] > 1e-12) < 2:
+                y_fit[sample, i] = y_sorted[sample, self.fit_index[i]]
+        return y_fit[:, self.fit_group]
+
+    def smooth(self, y):
+        """
+        Return the LOWESS fitted values of y in the original order.
+        Each row of a matrix of y values is smoothed separately.
+        """
+        y = np.asarray(y, dtype=float)
+        y_rows = y.reshape(-1, len(self.x))
+        if not self.is_valid or not np.all(np.isfinite(y)):
+            from statsmodels.nonparametric.smoothers_lowess import lowess
+
+            y_fitted = [lowess(a, self.x, return_sorted=False) for a in y_rows]
+            return np.reshape(y_fitted, y.shape)
+        y_sorted = y_rows[:, self.sort_index]
+        resid_weights = np.ones_like(y_sorted)
+        for robiter in range(self.it + 1):
+            y_fit = self.fit(y_sorted, resid_weights)
+            if robiter < self.it:
+                resid_weights = get_residual_weights(y_sorted, y_fit)
+        y_fitted = np.empty_like(y_fit)
+        y_fitted[:, self.sort_index] = y_fit
+        return y_fitted.reshape(y.shape)
+
+
+def get_residual_weights(y, y_fit):
+    """Return the bisquare robustness weights of the residuals of rows of fits."""
+    std_resid = np.abs(y - y_fit)
+    median = np.median(std_resid, axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std_resid = np.where(
+            median == 0,
+            (std_resid > 0).astype(float),
+            np.minimum(std_resid / (6.0 * median), 1.0),
+        )
+    resid_weights = 1.0 - std_resid * std_resid
+    return resid_weights * resid_weights
+
+
+class BinnedSmoother:
+    """
+    A fit of values against x that interpolates between the medians of bins
+    of x with similar numbers of points. Points with the same x are kept
+    in the same bin. This is a fast, robust alternative to LOWESS for
+    GC correction.
+    """
+
+    def __init__(self, x, num_bins=GC_BINS, min_bin_size=GC_BIN_MIN_REGIONS):
+        self.x = np.array(x, dtype=float)
+        n = len(self.x)
+        num_bins = max(min(num_bins, n // min_bin_size), 1)
+        self.sort_index = np.argsort(self.x, kind="stable")
+        x_sorted = self.x[self.sort_index]
+        bin_starts = np.searchsorted(
+            x_sorted, x_sorted[np.arange(1, num_bins) * n // num_bins], side="left"
+        )
+        bin_ends = np.unique(np.append(bin_starts[bin_starts > 0], n))
+        self.bins = list(zip(np.append(0, bin_ends[:-1]), bin_ends))
+        bin_centers = np.array([np.median(x_sorted[a:b]) for a, b in self.bins])
+        # Each point is interpolated between the centers of two bins,
+        # and points beyond the first or last center take its value
+        if len(bin_centers) > 1:
+            self.right_bin = np.clip(
+                np.searchsorted(bin_centers, self.x, side="right"),
+                1,
+                len(bin_centers) - 1,
+            )
+            left_center = bin_centers[self.right_bin - 1]
+            self.right_fraction = np.clip(
+                (self.x - left_center) / (bin_centers[self.right_bin] - left_center),
+                0,
+                1,
+            )
+        else:
+            self.right_bin = np.zeros(n, dtype=int)
+            self.right_fraction = np.zeros(n)
+
+    def smooth(self, y):
+        """
+        Return the fitted values of y in the original order.
+        Each row of a matrix of y values is fitted separately.
+        """
+        y = np.asarray(y, dtype=float)
+        y_sorted = y.reshape(-1, len(self.x))[:, self.sort_index]
+        bin_medians = np.column_stack(
+            [np.median(y_sorted[:, a:b], axis=1) for a, b in self.bins]
+        )
+        left_bin = np.maximum(self.right_bin - 1, 0)
+        y_fitted = (
+            bin_medians[:, left_bin] * (1 - self.right_fraction)
+            + bin_medians[:, self.right_bin] * self.right_fraction
+        )
+        return y_fitted.reshape(y.shape)
+
+
+def get_smoother(smoother_class, x):
+    """
+    Return a smoother of the given class for the given x values. The smoother
+    of the last x values is kept, as all samples of a run share the same regions.
+    """
+    x = np.asarray(x, dtype=float)
+    smoother = _smoothers.get(smoother_class)
+    if smoother is None or not np.array_equal(smoother.x, x):
+        smoother = smoother_class(x)
+        _smoothers[smoother_class] = smoother
+    return smoother
+
+
+def get_lowess_smoother(x):
+    """Return the LowessSmoother of the given x values."""
+    return get_smoother(LowessSmoother, x)
+
+
+def get_binned_smoother(x):
+    """Return the BinnedSmoother of the given x values."""
+    return get_smoother(BinnedSmoother, x)
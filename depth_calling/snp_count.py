@@ -21,12 +21,22 @@
 #
 
 from collections import namedtuple
-import pysam
-from .utilities import open_alignment_file
+from bisect import bisect_left
+from array import array
+from .utilities import alignment_handle
 
 
 COMPLEMENT = {"A": "T", "T": "A", "C": "G", "G": "C", "N": "N"}
 SITES_STRINGENT = []  # consider being more stringent for exon8 site for SMN
+# Bases below this quality are left out of pileups by pysam
+PILEUP_MIN_BASE_QUALITY = 13
+# Sites are counted from one fetch when they are at most this far apart
+SITE_WINDOW_MAX_GAP = 10000
+# Cigar operations that align a read base to a reference base
+CIGAR_ALIGNED = {0, 7, 8}
+CIGAR_QUERY_ONLY = {1, 4}
+CIGAR_REFERENCE_ONLY = {2, 3}
+snp_lookup = namedtuple("snp_lookup", "dsnp1 dsnp2 nchr dindex")
 
 
 def reverse_complement(sequence):
@@ -71,11 +81,72 @@ def get_snp_position(pos_file):
                 dindex.setdefault(reg1_name, counter)
                 dindex.setdefault(reg2_name, counter)
     nchr = split_line[0]
-    snp_lookup = namedtuple("snp_lookup", "dsnp1 dsnp2 nchr dindex")
     dbsnp = snp_lookup(dsnp1, dsnp2, nchr, dindex)
     return dbsnp
 
 
+class SiteRegion:
+    """
+    The sites of a panel in one region, compiled for read counting:
+    the sorted 0-based positions of the sites and, at each position,
+    the site index, the allele tuples of region1 and region2 and whether
+    the more stringent read filter applies.
+    """
+
+    __slots__ = ("positions", "sites")
+
+    def __init__(self, positions, sites):
+        self.positions = positions
+        self.sites = sites
+
+
+class SitePanel:
+    """A SNP or variant panel compiled for read counting in both regions."""
+
+    __slots__ = ("nchr", "num_sites", "regions")
+
+    def __init__(self, nchr, num_sites, regions):
+        self.nchr = nchr
+        self.num_sites = num_sites
+        self.regions = regions
+
+
+def compile_site_region(dsnp, dindex):
+    """Return the SiteRegion of the sites of one region of a SNP lookup."""
+    dsites = {}
+    for snp_position_ori in dsnp:
+        snp_position = int(snp_position_ori.split("_")[0])
+        reg1_allele, reg2_allele = dsnp[snp_position_ori].split("_")
+        dsites.setdefault(snp_position - 1, []).append(
+            (
+                dindex[snp_position_ori],
+                tuple(reg1_allele.split(",")),
+                tuple(reg2_allele.split(",")),
+                snp_position in SITES_STRINGENT,
+            )
+        )
+    positions = sorted(dsites)
+    return SiteRegion(
+        array("q", positions), tuple(tuple(dsites[a]) for a in positions)
+    )
+
+
+def compile_site_panel(dbsnp):
+    """Return the SitePanel of a SNP lookup."""
+    dsnp1, dsnp2, nchr, dindex = dbsnp
+    assert len(dsnp1) == len(dsnp2)
+    return SitePanel(
+        nchr,
+        len(dsnp1),
+        (compile_site_region(dsnp1, dindex), compile_site_region(dsnp2, dindex)),
+    )
+
+
+def load_site_panel(pos_file):
+    """Return the SitePanel of the sites listed in a SNP location file."""
+    return compile_site_panel(get_snp_position(pos_file))
+
+
 def passing_read(pileupread):
     """Return whether a read passes filter."""
     return (
@@ -89,61 +160,192 @@ def passing_read(pileupread):
 
 def passing_read_stringent(pileupread):
     """Return whether a read passes more stringent filter."""
-    number_mismatch = get_nm(pileupread.alignment.tags)
-    align_len = pileupread.alignment.query_alignment_length
-    read_len = len(pileupread.alignment.query_sequence)
+    return passing_read_stringent_position(
+        pileupread.alignment, pileupread.query_position
+    )
+
+
+def passing_read_stringent_position(read, query_position):
+    """Return whether a read passes more stringent filter at a query position."""
+    number_mismatch = get_nm(read.tags)
+    align_len = read.query_alignment_length
+    read_len = len(read.query_sequence)
     return (
         number_mismatch <= float(align_len) * 0.08
-        and pileupread.query_position > 0
-        and pileupread.query_position < read_len - 1
+        and query_position > 0
+        and query_position < read_len - 1
     )
 
 
-def get_reads_by_region(bamfile_handle, nchr, dsnp, dindex, min_mapq=0):
+def add_region_sites(dsites, site_region, lsnp1, lsnp2):
     """
-    Return the number of reads supporting region1 and region2.
+    Add the sites of a region to a dictionary of sites by 0-based position,
+    with the lists that count reads supporting region1 and region2.
     """
-    lsnp1 = [0] * len(dsnp)
-    lsnp2 = [0] * len(dsnp)
-    for snp_position_ori in dsnp:
-        snp_position = int(snp_position_ori.split("_")[0])
+    for position, sites in zip(site_region.positions, site_region.sites):
+        position_sites = dsites.setdefault(position, [])
+        for site in sites:
+            position_sites.append(site + (lsnp1, lsnp2))
+    return dsites
+
+
+def count_site_alleles(read, start_pos, position_sites):
+    """Count the alleles of a read at the sites of one position."""
+    read_seq = read.query_sequence
+    for (
+        dsnp_index,
+        reg1_alleles,
+        reg2_alleles,
+        stringent,
+        lsnp1,
+        lsnp2,
+    ) in position_sites:
+        if stringent and not passing_read_stringent_position(read, start_pos):
+            continue
+        for allele in reg1_alleles:
+            if read_seq[start_pos : start_pos + len(allele)] == allele:
+                lsnp1[dsnp_index] += 1
+        for allele in reg2_alleles:
+            if read_seq[start_pos : start_pos + len(allele)] == allele:
+                lsnp2[dsnp_index] += 1
+
+
+def count_sites_pileup(bamfile_handle, nchr, dsites, min_mapq=0):
+    """
+    Count the reads supporting region1 and region2 at all sites
+    with a pileup at each site.
+    """
+    for position in sorted(dsites):
         for pileupcolumn in bamfile_handle.pileup(
             nchr,
-            snp_position - 1,
-            snp_position + 1,
+            position,
+            position + 2,
             truncate=True,
             stepper="nofilter",
             ignore_overlaps=False,
             ignore_orphan=False,
         ):
-            site_position = pileupcolumn.pos + 1
-            if site_position == snp_position:
-                reg1_allele, reg2_allele = dsnp[snp_position_ori].split("_")
+            if pileupcolumn.pos == position:
                 for read in pileupcolumn.pileups:
                     if (
                         passing_read(read)
                         and read.alignment.mapping_quality >= min_mapq
                     ):
-                        dsnp_index = dindex[snp_position_ori]
-                        read_seq = read.alignment.query_sequence
-                        if (
-                            site_position not in SITES_STRINGENT
-                            or passing_read_stringent(read)
-                        ):
-                            reg1_allele_split = reg1_allele.split(",")
-                            reg2_allele_split = reg2_allele.split(",")
-                            start_pos = read.query_position
-                            for allele in reg1_allele_split:
-                                end_pos = start_pos + len(allele)
-                                if read_seq[start_pos:end_pos] == allele:
-                                    lsnp1[dsnp_index] += 1
-                            for allele in reg2_allele_split:
-                                end_pos = start_pos + len(allele)
-                                if read_seq[start_pos:end_pos] == allele:
-                                    lsnp2[dsnp_index] += 1
+                        count_site_alleles(
+                            read.alignment, read.query_position, dsites[position]
+                        )
+
+
+def get_query_positions(read, positions):
+    """
+    Return the query position aligned to each of the sorted reference positions
+    covered by a read, or None where the read has a deletion or a skip.
+    """
+    query_positions = []
+    i = 0
+    ref_pos = read.reference_start
+    query_pos = 0
+    for operation, length in read.cigartuples:
+        if i == len(positions):
+            break
+        if operation in CIGAR_ALIGNED:
+            while i < len(positions) and positions[i] < ref_pos + length:
+                query_positions.append(query_pos + positions[i] - ref_pos)
+                i += 1
+            ref_pos += length
+            query_pos += length
+        elif operation in CIGAR_REFERENCE_ONLY:
+            while i < len(positions) and positions[i] < ref_pos + length:
+                query_positions.append(None)
+                i += 1
+            ref_pos += length
+        elif operation in CIGAR_QUERY_ONLY:
+            query_pos += length
+    return query_positions
+
+
+def group_sites_into_windows(positions, max_gap=SITE_WINDOW_MAX_GAP):
+    """Return sorted site positions in windows of nearby sites."""
+    windows = []
+    for position in sorted(positions):
+        if windows == [] or position - windows[-1][-1] > max_gap:
+            windows.append([])
+        windows[-1].append(position)
+    return windows
+
+
+def count_sites_single_pass(bamfile_handle, nchr, dsites, min_mapq=0):
+    """
+    Count the reads supporting region1 and region2 at all sites.
+    Reads in each window of nearby sites are fetched once and each read
+    is matched against all the sites it covers, with the same filters as
+    the pileup in count_sites_pileup.
+    """
+    for positions in group_sites_into_windows(dsites):
+        for read in bamfile_handle.fetch(nchr, positions[0], positions[-1] + 1):
+            if (
+                read.is_unmapped
+                or read.is_secondary
+                or read.is_supplementary
+                or read.is_duplicate
+                or read.mapping_quality < min_mapq
+            ):
+                continue
+            read_positions = positions[
+                bisect_left(positions, read.reference_start) : bisect_left(
+                    positions, read.reference_end
+                )
+            ]
+            if read_positions == []:
+                continue
+            read_qual = read.query_qualities
+            for position, start_pos in zip(
+                read_positions, get_query_positions(read, read_positions)
+            ):
+                if start_pos is None or (
+                    read_qual is not None
+                    and read_qual[start_pos] < PILEUP_MIN_BASE_QUALITY
+                ):
+                    continue
+                count_site_alleles(read, start_pos, dsites[position])
+
+
+SNP_COUNT_ENGINES = {
+    "pileup": count_sites_pileup,
+    "single_pass": count_sites_single_pass,
+}
+
+
+def get_reads_by_engine(
+    bamfile_handle, nchr, dsnp, dindex, min_mapq=0, snp_engine="single_pass"
+):
+    """Return the number of reads supporting region1 and region2 with an engine."""
+    if snp_engine not in SNP_COUNT_ENGINES:
+        raise Exception("SNP counting engine %s is not recognized." % snp_engine)
+    lsnp1 = [0] * len(dsnp)
+    lsnp2 = [0] * len(dsnp)
+    dsites = add_region_sites({}, compile_site_region(dsnp, dindex), lsnp1, lsnp2)
+    SNP_COUNT_ENGINES[snp_engine](bamfile_handle, nchr, dsites, min_mapq)
     return lsnp1, lsnp2
 
 
+def get_reads_by_region(bamfile_handle, nchr, dsnp, dindex, min_mapq=0):
+    """
+    Return the number of reads supporting region1 and region2.
+    """
+    return get_reads_by_engine(bamfile_handle, nchr, dsnp, dindex, min_mapq, "pileup")
+
+
+def get_reads_by_region_single_pass(bamfile_handle, nchr, dsnp, dindex, min_mapq=0):
+    """
+    Return the number of reads supporting region1 and region2.
+    Reads spanning the sites are fetched once instead of once per site.
+    """
+    return get_reads_by_engine(
+        bamfile_handle, nchr, dsnp, dindex, min_mapq, "single_pass"
+    )
+
+
 def get_fraction(lsnp1, lsnp2):
     """Return the fraction of reads supporting region1."""
     reg1_fraction = []
@@ -156,28 +358,53 @@ def get_fraction(lsnp1, lsnp2):
     return reg1_fraction
 
 
-def get_supporting_reads(bamf, dsnp1, dsnp2, nchr, dindex, reference=None):
+def get_supporting_reads(
+    bamf, dsnp1, dsnp2, nchr, dindex, reference=None, snp_engine="single_pass"
+):
     """
     Return the number of supporting reads at each position in
-    both region1 and region2.
+    both region1 and region2, given a bam file or an open alignment session.
     """
-    bamfile_handle = open_alignment_file(bamf, reference)
-    assert len(dsnp1) == len(dsnp2)
-    # Go through SNP sites in both regions,
-    # and count the number of reads supporting each gene.
-    lsnp1_reg1, lsnp2_reg1 = get_reads_by_region(bamfile_handle, nchr, dsnp1, dindex)
-    lsnp1_reg2, lsnp2_reg2 = get_reads_by_region(bamfile_handle, nchr, dsnp2, dindex)
-    lsnp1 = [sum(x) for x in zip(lsnp1_reg1, lsnp1_reg2)]
-    lsnp2 = [sum(x) for x in zip(lsnp2_reg1, lsnp2_reg2)]
-    bamfile_handle.close()
-    return lsnp1, lsnp2
+    return get_supporting_reads_panels(
+        bamf, [snp_lookup(dsnp1, dsnp2, nchr, dindex)], reference, snp_engine
+    )[0]
+
+
+def get_supporting_reads_panels(bamf, panels, reference=None, snp_engine="single_pass"):
+    """
+    Return the number of supporting reads at each position in both region1
+    and region2 for each of a list of site panels, such as the SNP and target
+    variant panels. The sites of all panels are counted together in one
+    traversal of each region.
+    """
+    if snp_engine not in SNP_COUNT_ENGINES:
+        raise Exception("SNP counting engine %s is not recognized." % snp_engine)
+    panel_counts = []
+    # Reads at a site of either region count towards the same totals
+    dsites_by_chr = {}
+    for panel in panels:
+        if isinstance(panel, snp_lookup):
+            panel = compile_site_panel(panel)
+        lsnp1 = [0] * panel.num_sites
+        lsnp2 = [0] * panel.num_sites
+        dsites = dsites_by_chr.setdefault(panel.nchr, {})
+        for site_region in panel.regions:
+            add_region_sites(dsites, site_region, lsnp1, lsnp2)
+        panel_counts.append((lsnp1, lsnp2))
+    with alignment_handle(bamf, reference) as bamfile_handle:
+        for nchr, dsites in dsites_by_chr.items():
+            SNP_COUNT_ENGINES[snp_engine](bamfile_handle, nchr, dsites)
+    return panel_counts
 
 
-def get_supporting_reads_single_region(bamf, dsnp1, nchr, dindex, reference=None):
+def get_supporting_reads_single_region(
+    bamf, dsnp1, nchr, dindex, reference=None, snp_engine="single_pass"
+):
     """
     Return the number of supporting reads at each position only in region1.
     """
-    bamfile_handle = open_alignment_file(bamf, reference)
-    lsnp1, lsnp2 = get_reads_by_region(bamfile_handle, nchr, dsnp1, dindex, 10)
-    bamfile_handle.close()
+    with alignment_handle(bamf, reference) as bamfile_handle:
+        lsnp1, lsnp2 = get_reads_by_engine(
+            bamfile_handle, nchr, dsnp1, dindex, 10, snp_engine
+        )
     return lsnp1, lsnp2
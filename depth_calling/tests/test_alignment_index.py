@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import sys
+import os
+import gzip
+import struct
+import shutil
+import pytest
+
+from ..alignment_index import (
+    find_index_file,
+    parse_bai,
+    parse_crai,
+    load_index,
+    get_region_costs,
+    BGZF_BLOCK_BYTES,
+)
+from ..utilities import open_alignment_file
+
+test_data_dir = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+class TestAlignmentIndex(object):
+    def test_parse_bai(self):
+        bam = os.path.join(test_data_dir, "NA12885.bam")
+        assert find_index_file(bam) == bam + ".bai"
+        linear_index = parse_bai(bam + ".bai")
+        bamfile = open_alignment_file(bam)
+        assert len(linear_index) == bamfile.nreferences
+        chr5_index = linear_index[bamfile.get_tid("5")]
+        assert all(chr5_index[1:] >= chr5_index[:-1])
+        bamfile.close()
+        # the parsed index is reused
+        bai = bam + ".bai"
+        assert load_index(bai, parse_bai) is load_index(bai, parse_bai)
+
+    def test_parse_bai_pseudo_bin(self, tmp_path):
+        bai = str(tmp_path / "test.bam.bai")
+        with open(bai, "wb") as bai_output:
+            bai_output.write(b"BAI\x01" + struct.pack("<ii", 1, 2))
+            # a bin with one chunk, then the pseudo-bin with the data offsets
+            bai_output.write(struct.pack("<IiQQ", 4681, 1, 100 << 16, 900 << 16))
+            bai_output.write(
+                struct.pack("<IiQQQQ", 37450, 2, 100 << 16, 5000 << 16, 10, 0)
+            )
+            bai_output.write(struct.pack("<iQQQ", 3, 100 << 16, 0, 700 << 16))
+        linear_index = parse_bai(bai)
+        assert len(linear_index) == 1
+        assert list(linear_index[0]) == [100, 100, 700, 5000]
+
+    def test_parse_crai(self, tmp_path):
+        crai = str(tmp_path / "test.cram.crai")
+        with gzip.open(crai, "wt") as crai_output:
+            crai_output.write("0\t1\t1000\t100\t200\t5000\n")
+            crai_output.write("0\t900\t2000\t5300\t200\t8000\n")
+            crai_output.write("2\t1\t500\t13300\t200\t100\n")
+        slices = parse_crai(crai)
+        starts, ends, sizes = slices[0]
+        assert list(starts) == [0, 899]
+        assert list(ends) == [1000, 2899]
+        assert list(sizes) == [5000, 8000]
+        assert list(slices[2][2]) == [100]
+
+    def test_region_costs(self, tmp_path):
+        bam = os.path.join(test_data_dir, "NA12885.bam")
+        bamfile = open_alignment_file(bam)
+        regions = [
+            ("5", 69368682, 69374582),
+            ("1", 36555892, 36557892),
+            ("1", 186083014, 186085014),
+            ("7", 1000, 2000),
+        ]
+        costs = get_region_costs(bamfile, regions)
+        bamfile.close()
+        # about 7000 reads in the first region and 600 in the next two
+        assert costs[0] > 5 * costs[1]
+        assert costs[0] > 5 * costs[2]
+        assert costs[1] > BGZF_BLOCK_BYTES
+        # no reads
+        assert costs[3] == BGZF_BLOCK_BYTES
+
+        # without an index, the cost is the region length
+        shutil.copy(bam, str(tmp_path / "noindex.bam"))
+        bamfile = open_alignment_file(str(tmp_path / "noindex.bam"))
+        assert get_region_costs(bamfile, regions) == [5900, 2000, 2000, 1000]
+        bamfile.close()
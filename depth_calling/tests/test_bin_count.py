@@ -24,14 +24,24 @@ import sys
 import os
 import pytest
 import pysam
+import multiprocessing as mp
 
 
 from ..bin_count import (
     get_read_count,
+    get_read_counts,
+    group_regions_into_windows,
+    partition_by_cost,
     get_read_length,
     mad,
     normalize,
+    normalize_samples,
     get_normed_depth,
+    get_normed_depth_from_count,
+    get_region_counts,
+    write_count_file,
+    get_count_from_file,
+    get_count_meta_from_file,
 )
 from ..utilities import parse_region_file, open_alignment_file
 
@@ -53,6 +63,62 @@ class TestBinCount(object):
 
         bamfile.close()
 
+    def test_group_regions_into_windows(self):
+        regions = [
+            ("5", 3000, 4000),
+            ("5", 1000, 2000),
+            ("1", 1000, 2000),
+            ("5", 2000, 3000),
+            ("5", 2500, 3500),
+            ("5", 50000, 52000),
+        ]
+        windows = group_regions_into_windows(regions)
+        # an overlapping region starts a new window
+        assert windows == [
+            ("1", [2]),
+            ("5", [1, 3]),
+            ("5", [4]),
+            ("5", [0]),
+            ("5", [5]),
+        ]
+        windows = group_regions_into_windows(regions, max_gap=100000)
+        assert windows == [("1", [2]), ("5", [1, 3]), ("5", [4]), ("5", [0, 5])]
+        windows = group_regions_into_windows(regions, max_gap=100000, max_size=10000)
+        assert len(windows) == 5
+
+    def test_read_counts_windowed(self):
+        bam = os.path.join(test_data_dir, "NA12885.bam")
+        bamfile = open_alignment_file(bam)
+        # adjacent, overlapping and distant regions
+        regions = [("5", a, a + 500) for a in range(70244100, 70250000, 500)]
+        regions += [("5", 70245350, 70246350), ("5", 69372349, 69372400)]
+        region_counts = [get_read_count(bamfile, region) for region in regions]
+        assert get_read_counts(bamfile, regions, "window") == region_counts
+        assert get_read_counts(bamfile, regions, "window", 30) == [
+            get_read_count(bamfile, region, 30) for region in regions
+        ]
+        bamfile.close()
+
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        normed_depth = get_normed_depth(
+            bam, region_dic, gc_correct=False, count_engine="window"
+        )
+        assert round(normed_depth.normalized["exon16"], 3) == 3.876
+        assert round(normed_depth.mediandepth, 2) == 48.75
+
+    def test_partition_by_cost(self):
+        regions = [("5", a * 1000, a * 1000 + 500) for a in [6, 2, 9, 1, 5, 3]]
+        regions.append(("1", 1000, 1500))
+        groups = partition_by_cost(regions, 3, [1, 1, 1, 1, 1, 1, 1])
+        assert groups == [[6, 3], [1, 5, 4], [0, 2]]
+        # deep regions are split across workers
+        groups = partition_by_cost(regions, 3, [1, 1, 1, 1, 1, 10, 1])
+        assert groups == [[6, 3, 1], [5], [4, 0, 2]]
+        groups = partition_by_cost(regions, 10, [1] * 7)
+        assert sorted(sum(groups, [])) == list(range(7))
+        assert len(groups) == 7
+
     def test_get_readlength(self):
         bam = os.path.join(test_data_dir, "NA12878.bam")
         bamfile = open_alignment_file(bam)
@@ -83,6 +149,33 @@ class TestBinCount(object):
         assert norm.mediandepth == 45
         assert round(norm.mad, 5) == 0.057
 
+    def test_normalize_samples(self):
+        counts_for_normalization = [0.3, 0.25, 0.3, 0.228, 0.29, 0.35, 0.31, 0.38, 0.42]
+        gc_for_normalization = [0.42, 0.42, 0.43, 0.39, 0.4, 0.45, 0.43, 0.5, 0.6]
+        region_type_cn = {"exon16": 2, "exon78": 2}
+        count_matrix = [counts_for_normalization, counts_for_normalization[::-1]]
+        read_lengths = [150, 100]
+        for gc_correct in [True, False]:
+            norms = normalize_samples(
+                count_matrix,
+                gc_for_normalization,
+                region_type_cn,
+                read_lengths,
+                gc_correct,
+            )
+            for counts, read_length, norm in zip(count_matrix, read_lengths, norms):
+                sample_norm = normalize(
+                    counts,
+                    gc_for_normalization,
+                    region_type_cn,
+                    read_length,
+                    gc_correct,
+                )
+                assert norm.normalized == pytest.approx(sample_norm.normalized)
+                assert norm.mediandepth == sample_norm.mediandepth
+                assert norm.mad == sample_norm.mad
+        assert norms[1].mediandepth == 30
+
     def test_bin_count(self):
         bam = os.path.join(test_data_dir, "NA12885.bam")
         region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
@@ -92,3 +185,45 @@ class TestBinCount(object):
         assert round(normed_depth.normalized["exon78"], 3) == 4.024
         assert round(normed_depth.mediandepth, 2) == 48.75
         assert round(normed_depth.mad, 5) == 0.066
+
+    def test_bin_count_in_pool(self):
+        bam = os.path.join(test_data_dir, "NA12885.bam")
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        normed_depth = get_normed_depth(bam, region_dic, gc_correct=False)
+        # chunks dispatched to a temporary or a long-lived pool
+        assert get_normed_depth(bam, region_dic, 3, gc_correct=False) == normed_depth
+        with mp.Pool(2) as pool:
+            assert (
+                get_normed_depth(bam, region_dic, 2, gc_correct=False, pool=pool)
+                == normed_depth
+            )
+
+    def test_count_file(self, tmpdir):
+        bam = os.path.join(test_data_dir, "NA12885.bam")
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        count_dic, _ = get_region_counts(bam, region_dic)
+        count_file = str(tmpdir.join("NA12885_count.txt"))
+        write_count_file(count_file, region_dic, count_dic)
+        assert os.listdir(str(tmpdir)) == ["NA12885_count.txt"]
+        normed_depth = get_normed_depth(bam, region_dic, gc_correct=False)
+        normed_depth_from_count = get_normed_depth_from_count(
+            count_file, region_dic, 150, gc_correct=False
+        )
+        assert normed_depth_from_count.normalized == normed_depth.normalized
+        assert normed_depth_from_count.mad == normed_depth.mad
+        assert get_count_meta_from_file(count_file) == {}
+
+    def test_count_file_meta(self, tmpdir):
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        count_dic = {}
+        for region_type in region_dic:
+            for i, (region, gc) in enumerate(region_dic[region_type]):
+                count_dic[region[3]] = i
+        count_meta = {"read_length": 150.0, "SMN1_read_support": [46, 32, 0]}
+        count_file = str(tmpdir.join("NA12885_count.txt"))
+        write_count_file(count_file, region_dic, count_dic, count_meta)
+        assert get_count_meta_from_file(count_file) == count_meta
+        assert get_count_from_file(count_file) == count_dic
@@ -26,6 +26,7 @@ import pytest
 
 from ..copy_number_call import (
     call_reg1_cn,
+    call_reg1_cn_batch,
     process_raw_call_gc,
     process_raw_call_denovo,
 )
@@ -42,6 +43,23 @@ class TestCallCN(object):
         call = call_reg1_cn(3, 30, 30)
         assert call == [2, 0.689, 1, 0.311]
 
+    def test_call_reg1_cn_batch(self):
+        counts_reg1 = [30, 10, 30, 0, 5, 0, 17, 120]
+        counts_reg2 = [30, 30, 10, 0, 0, 5, 40, 95]
+        for full_cn in [2, 3, 4, 6]:
+            calls = call_reg1_cn_batch(full_cn, counts_reg1, counts_reg2)
+            assert calls == [
+                call_reg1_cn(full_cn, count1, counts_reg2[i])
+                for i, count1 in enumerate(counts_reg1)
+            ]
+        calls = call_reg1_cn_batch(4, [1, 10], [20, 30], min_read=3)
+        assert calls == [call_reg1_cn(4, 1, 20, 3), call_reg1_cn(4, 10, 30, 3)]
+        assert call_reg1_cn_batch(None, [10], [30]) == [[None]]
+        assert call_reg1_cn_batch(0, [10], [30]) == [[0]]
+        # no underflow when all likelihoods are tiny at high depth
+        assert call_reg1_cn(1, 1000, 3000) == [None]
+        assert call_reg1_cn_batch(1, [1000], [3000]) == [[1]]
+
     def test_process_raw_call_gc(self):
         lcn = [[1], [1, 0.8, 2, 0.2]]
         filtered_call = process_raw_call_gc(lcn, 0.7)
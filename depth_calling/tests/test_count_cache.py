@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import sys
+import os
+import shutil
+import pytest
+
+from ..count_cache import CountCache
+from ..bin_count import get_normed_depth
+from ..utilities import parse_region_file, AlignmentSession
+
+test_data_dir = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+class TestCountCache(object):
+    def test_count_cache(self, tmpdir):
+        bam = str(tmpdir.join("sample.bam"))
+        shutil.copy(os.path.join(test_data_dir, "NA12885.bam"), bam)
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        count_cache = CountCache(str(tmpdir.join("cache")))
+        assert count_cache.get(bam, region_dic) is None
+        count_dic = {a[0][3]: i for i, a in enumerate(region_dic["norm"])}
+        count_dic.update({a[0][3]: 1 for a in region_dic["exon16"]})
+        count_dic.update({a[0][3]: 2 for a in region_dic["exon78"]})
+        count_cache.put(bam, region_dic, count_dic, 150.0)
+        assert count_cache.get(bam, region_dic) == (count_dic, 150.0)
+        # entries change with the regions and the alignment file
+        region_dic_short = {"norm": region_dic["norm"][:10]}
+        assert count_cache.get(bam, region_dic_short) is None
+        os.utime(bam, ns=(0, 0))
+        assert count_cache.get(bam, region_dic) is None
+
+    def test_count_cache_eviction(self, tmpdir):
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = {"norm": parse_region_file(region_file)["norm"][:10]}
+        count_dic = {a[0][3]: 1 for a in region_dic["norm"]}
+        bams = []
+        for i in range(3):
+            bams.append(str(tmpdir.join("sample%i.bam" % i)))
+            open(bams[-1], "w").close()
+        count_cache = CountCache(str(tmpdir.join("cache")))
+        count_cache.put(bams[0], region_dic, count_dic, 150.0)
+        entry_size = os.path.getsize(count_cache.get_path(bams[0], region_dic))
+        count_cache.max_size = 2 * entry_size
+        os.utime(count_cache.get_path(bams[0], region_dic), ns=(1, 1))
+        count_cache.put(bams[1], region_dic, count_dic, 150.0)
+        os.utime(count_cache.get_path(bams[1], region_dic), ns=(2, 2))
+        # using the oldest entry keeps it in the cache
+        assert count_cache.get(bams[0], region_dic) is not None
+        count_cache.put(bams[2], region_dic, count_dic, 150.0)
+        assert count_cache.get(bams[0], region_dic) is not None
+        assert count_cache.get(bams[1], region_dic) is None
+        assert count_cache.get(bams[2], region_dic) is not None
+
+    def test_normed_depth_from_cache(self, tmpdir):
+        bam = os.path.join(test_data_dir, "NA12885.bam")
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        count_cache = CountCache(str(tmpdir.join("cache")))
+        normed_depth = get_normed_depth(
+            bam, region_dic, gc_correct=False, count_cache=count_cache
+        )
+        assert count_cache.get(bam, region_dic) is not None
+        with AlignmentSession(bam) as session:
+            assert (
+                get_normed_depth(
+                    session, region_dic, gc_correct=False, count_cache=count_cache
+                )
+                == normed_depth
+            )
+            # the alignment file is not opened on a cache hit
+            assert session._handle is None
@@ -98,3 +98,23 @@ class TestGMM(object):
         assert cncall[0] == 5
         cncall = test_gmm.gmm_call(5.38)
         assert cncall[0] is None
+
+    def test_gmmcall_batch(self):
+        gmm_file = os.path.join(test_data_dir, "SMN_gmm.txt")
+        dpar_tmp = parse_gmm_file(gmm_file)
+        for svid in ["exon1-6", "exon7-8"]:
+            test_gmm = Gmm()
+            test_gmm.set_gmm_par(dpar_tmp, svid)
+            values = np.linspace(0, 12.05, 483)
+            batch_call = test_gmm.gmm_call_batch(values)
+            assert batch_call.post_prob.shape == (len(values), 11)
+            assert np.allclose(np.sum(batch_call.post_prob, axis=1), 1)
+            for value, cn, depth_value in zip(
+                values, batch_call.cn, batch_call.depth_value
+            ):
+                cncall = test_gmm.gmm_call(value)
+                assert cn == cncall.cn
+                assert depth_value == cncall.depth_value
+        batch_call = test_gmm.gmm_call_batch([0.95, 2.364, 3.35])
+        assert batch_call.cn == [1, None, 3]
+        assert batch_call.p_value[0] > 0.001
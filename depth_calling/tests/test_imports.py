@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+
+import sys
+import os
+import subprocess
+import pytest
+
+package_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+HEAVY_MODULES = ["scipy", "statsmodels", "pysam"]
+
+
+def get_imported_heavy_modules(module):
+    """Return the heavy modules imported by a module in a fresh interpreter."""
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys; import %s; print(' '.join(a for a in %r if a in sys.modules))"
+            % (module, HEAVY_MODULES),
+        ],
+        cwd=os.path.abspath(package_dir),
+        universal_newlines=True,
+    )
+    return output.split()
+
+
+class TestImports(object):
+    def test_no_heavy_imports_at_startup(self):
+        for module in ["smn_caller", "smn_count"]:
+            assert get_imported_heavy_modules(module) == []
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+
+import sys
+import os
+import math
+import numpy as np
+import pytest
+
+from ..numerics import (
+    norm_pdf,
+    norm_cdf,
+    norm_pdf_array,
+    norm_cdf_array,
+    log_factorial,
+    xlogy,
+    poisson_logpmf,
+    poisson_pmf,
+)
+
+
+class TestNumerics(object):
+    def test_norm(self):
+        stats = pytest.importorskip("scipy.stats")
+        values = np.linspace(-30, 30, 6001)
+        assert norm_pdf_array(values) == pytest.approx(
+            stats.norm.pdf(values), rel=1e-12, abs=1e-300
+        )
+        assert norm_cdf_array(values) == pytest.approx(
+            stats.norm.cdf(values), rel=1e-12, abs=1e-300
+        )
+        for value in values[::100]:
+            assert norm_pdf(value) == pytest.approx(stats.norm.pdf(value), rel=1e-12)
+            assert norm_cdf(value) == pytest.approx(stats.norm.cdf(value), rel=1e-12)
+
+    def test_poisson(self):
+        stats = pytest.importorskip("scipy.stats")
+        for count in [0, 1, 5, 30, 150, 4095, 4096, 20000]:
+            assert log_factorial(count) == pytest.approx(math.lgamma(count + 1))
+            for mean in [0.01, 1, 30, 150, 1000]:
+                assert poisson_logpmf(count, mean) == pytest.approx(
+                    stats.poisson.logpmf(count, mean), rel=1e-12
+                )
+                assert poisson_pmf(count, mean) == pytest.approx(
+                    stats.poisson.pmf(count, mean), rel=1e-10, abs=1e-300
+                )
+        assert poisson_pmf(0, 0) == 1
+        assert poisson_pmf(3, 0) == 0
+
+    def test_xlogy(self):
+        assert list(xlogy([0, 0, 2], [0, 3, math.e])) == [0, 0, 2]
+        assert xlogy([1], [0])[0] == -math.inf
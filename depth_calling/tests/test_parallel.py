@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import sys
+import os
+import pytest
+
+from ..parallel import (
+    split_threads,
+    partition_by_size,
+    run_samples,
+    start_worker_pool,
+    get_worker_pool,
+    stop_worker_pool,
+)
+
+
+def square(x):
+    return x * x
+
+
+def square_with_pool(x):
+    pool = get_worker_pool()
+    if pool is None:
+        return square(x), None
+    return sum(pool.map(square, [x])), os.getpid()
+
+
+class TestParallel(object):
+    def test_split_threads(self):
+        assert split_threads(1, 100) == (1, 1)
+        assert split_threads(64, 2000) == (8, 8)
+        assert split_threads(16, 2000) == (4, 4)
+        assert split_threads(10, 2000) == (3, 3)
+        # never more sample workers than samples
+        assert split_threads(64, 2) == (2, 32)
+        assert split_threads(64, 0) == (1, 64)
+        # user-specified number of samples to run at the same time
+        assert split_threads(64, 2000, 16) == (16, 4)
+        assert split_threads(4, 2000, 8) == (4, 1)
+
+    def test_partition_by_size(self):
+        sizes = [10, 70, 30, 30, 50, 20]
+        groups = partition_by_size(sizes, 3)
+        assert groups == [[1], [4, 5], [0, 2, 3]]
+        assert sorted(sum(groups, [])) == list(range(len(sizes)))
+        assert [sum(sizes[i] for i in group) for group in groups] == [70, 70, 70]
+        assert partition_by_size([5, 5], 3) == [[0], [1], []]
+
+    def test_run_samples(self):
+        samples = list(range(20))
+        expected = [a * a for a in samples]
+        assert list(run_samples(square, samples)) == expected
+        assert list(run_samples(square, samples, 3)) == expected
+
+    def test_worker_pool(self):
+        assert start_worker_pool(1) is None
+        pool = start_worker_pool(2, maxtasksperchild=1)
+        assert get_worker_pool() is pool
+        assert pool.map(square, range(5)) == [0, 1, 4, 9, 16]
+        stop_worker_pool()
+        assert get_worker_pool() is None
+
+    def test_run_samples_with_pool(self):
+        samples = list(range(8))
+        expected = [a * a for a in samples]
+        results = list(run_samples(square_with_pool, samples, 1, 2))
+        assert [a[0] for a in results] == expected
+        assert get_worker_pool() is None
+        # one long-lived pool per sample worker process
+        results = list(run_samples(square_with_pool, samples, 2, 2))
+        assert [a[0] for a in results] == expected
+        assert len(set(a[1] for a in results)) <= 2
+        # no pool for a single region worker
+        results = list(run_samples(square_with_pool, samples, 2, 1))
+        assert results == [(a, None) for a in expected]
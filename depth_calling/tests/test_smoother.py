@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import sys
+import os
+import pytest
+import numpy as np
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+from ..smoother import (
+    LowessSmoother,
+    BinnedSmoother,
+    get_lowess_smoother,
+    get_binned_smoother,
+)
+from ..utilities import parse_region_file
+
+test_data_dir = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+class TestSmoother(object):
+    def test_lowess_smoother(self):
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        x_gc = np.array([float(gc) for region, gc in region_dic["norm"]])
+        rng = np.random.RandomState(0)
+        y_counts = rng.gamma(20, 0.05, (3, len(x_gc)))
+        # outliers are down-weighted in the robustness iterations
+        y_counts[0, :20] *= 5
+        y_counts[1] = np.round(y_counts[1], 1)
+        smoother = get_lowess_smoother(x_gc)
+        assert get_lowess_smoother(list(x_gc)) is smoother
+        for y in y_counts:
+            assert smoother.smooth(y) == pytest.approx(
+                lowess(y, x_gc, return_sorted=False), abs=1e-10
+            )
+        assert smoother.smooth(y_counts) == pytest.approx(
+            np.array([smoother.smooth(y) for y in y_counts]), abs=1e-10
+        )
+
+    def test_lowess_smoother_fallback(self):
+        x = np.array([0.4, 0.4, 0.4, 0.5, 0.5])
+        y = np.array([1.0, 2.0, 3.0, np.nan, 2.0])
+        # missing values are dropped like in statsmodels
+        y_fit = lowess(y, x, return_sorted=False)
+        assert np.allclose(LowessSmoother(x).smooth(y), y_fit, equal_nan=True)
+        # neighborhoods that only contain one x value
+        x = np.array([0.4] * 5 + [0.5])
+        y = np.arange(6.0)
+        assert LowessSmoother(x).smooth(y) == pytest.approx(
+            lowess(y, x, return_sorted=False)
+        )
+
+    def test_binned_smoother(self):
+        x = np.repeat(np.arange(10) / 10.0, 30)
+        smoother = BinnedSmoother(x, num_bins=4, min_bin_size=50)
+        # bins of about 75 points without splitting points of the same x
+        assert [(int(a), int(b)) for a, b in smoother.bins] == [
+            (0, 60),
+            (60, 150),
+            (150, 210),
+            (210, 300),
+        ]
+        y = 2 * x + 1
+        y_fit = smoother.smooth(np.array([y, -y]))
+        # linear between the bin centers and constant beyond them
+        inside = (x >= 0.05) & (x <= 0.8)
+        assert y_fit[0][inside] == pytest.approx(y[inside])
+        assert y_fit[0][x == 0] == pytest.approx(1.1)
+        assert y_fit[0][x == 0.9] == pytest.approx(2.6)
+        assert y_fit[1] == pytest.approx(-y_fit[0])
+        # one bin for few points
+        assert len(BinnedSmoother(x[:100], min_bin_size=100).bins) == 1
+        assert get_binned_smoother(x) is get_binned_smoother(x)
+
+    def test_binned_smoother_robust(self):
+        region_file = os.path.join(test_data_dir, "SMN_region_37_short.bed")
+        region_dic = parse_region_file(region_file)
+        x_gc = np.array([float(gc) for region, gc in region_dic["norm"]] * 10)
+        rng = np.random.RandomState(0)
+        y = 1 + (x_gc - 0.45) + rng.normal(0, 0.05, len(x_gc))
+        y[:10] = 100
+        y_fit = BinnedSmoother(x_gc).smooth(y)
+        # the outliers do not pull the fit away from the trend
+        inside = (x_gc > np.quantile(x_gc, 0.1)) & (x_gc < np.quantile(x_gc, 0.9))
+        assert np.abs(y_fit - (1 + x_gc - 0.45))[inside].max() < 0.03
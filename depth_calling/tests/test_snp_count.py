@@ -28,8 +28,13 @@ from ..snp_count import (
     get_snp_position,
     get_supporting_reads,
     get_supporting_reads_single_region,
+    get_supporting_reads_panels,
+    load_site_panel,
     get_fraction,
+    get_reads_by_region,
+    get_reads_by_region_single_pass,
 )
+from ..utilities import open_alignment_file
 
 TOTAL_NUM_SITES = 16
 test_data_dir = os.path.join(os.path.dirname(__file__), "test_data")
@@ -79,6 +84,22 @@ class TestParseSNPFile(object):
         assert dsnp1["70248108_15"] == "CAC_CC"
         assert dsnp2["69372688_15"] == "CAC_CC"
 
+    def test_load_site_panel(self):
+        snp_file = os.path.join(test_data_dir, "SMN_SNP_37_test.txt")
+        panel = load_site_panel(snp_file)
+        assert panel.nchr == "5"
+        assert panel.num_sites == TOTAL_NUM_SITES
+        region1, region2 = panel.regions
+        assert list(region1.positions) == sorted(region1.positions)
+        assert len(region1.positions) == TOTAL_NUM_SITES
+        # 0-based positions with the site index and alleles of both regions
+        assert region1.sites[region1.positions.index(70245875)] == (
+            (1, ("T",), ("G",), False),
+        )
+        assert region2.sites[region2.positions.index(69372687)] == (
+            (15, ("CAC",), ("CC",), False),
+        )
+
 
 class TestReadCount(object):
     def test_get_snp_count(self):
@@ -107,6 +128,40 @@ class TestReadCount(object):
         assert lsnp1 == [46, 32, 45, 36, 26, 14, 36, 54, 38, 34, 41, 41, 40, 51, 40, 20]
         assert lsnp2 == [0, 0, 0, 0, 0, 11, 0, 0, 0, 0, 0, 0, 0, 0, 0, 16]
 
+    def test_snp_count_engines(self):
+        for snp_file_name in ["SMN_SNP_37.txt", "SMN_SNP_37_test.txt"]:
+            snp_file = os.path.join(test_data_dir, snp_file_name)
+            dsnp1, dsnp2, nchr, dindex = get_snp_position(snp_file)
+            for bam_name in ["NA12878.bam", "NA12885.bam"]:
+                bamfile = open_alignment_file(os.path.join(test_data_dir, bam_name))
+                for dsnp in [dsnp1, dsnp2]:
+                    for min_mapq in [0, 10]:
+                        assert get_reads_by_region_single_pass(
+                            bamfile, nchr, dsnp, dindex, min_mapq
+                        ) == get_reads_by_region(bamfile, nchr, dsnp, dindex, min_mapq)
+                bamfile.close()
+
+    def test_supporting_reads_panels(self):
+        snp_db = get_snp_position(os.path.join(test_data_dir, "SMN_SNP_37.txt"))
+        indel_db = get_snp_position(os.path.join(test_data_dir, "SMN_SNP_37_test.txt"))
+        bam = os.path.join(test_data_dir, "NA12885.bam")
+        for snp_engine in ["single_pass", "pileup"]:
+            panel_counts = get_supporting_reads_panels(
+                bam, [snp_db, indel_db], snp_engine=snp_engine
+            )
+            assert panel_counts == [
+                get_supporting_reads(bam, *snp_db, snp_engine="pileup"),
+                get_supporting_reads(bam, *indel_db, snp_engine="pileup"),
+            ]
+            assert (
+                get_supporting_reads_panels(
+                    bam,
+                    [load_site_panel(os.path.join(test_data_dir, "SMN_SNP_37.txt"))],
+                    snp_engine=snp_engine,
+                )
+                == panel_counts[:1]
+            )
+
     def test_get_fraction(self):
         lsnp1 = [16, 15, 32, 25, 28, 0]
         lsnp2 = [40, 45, 31, 30, 27, 0]
@@ -24,15 +24,72 @@ import sys
 import os
 import pytest
 
-from ..utilities import parse_region_file
+from ..utilities import (
+    parse_region_file,
+    AlignmentSession,
+    alignment_handle,
+    get_worker_session,
+    get_sample_order,
+    parse_shard,
+    get_shard,
+)
 
 test_data_dir = os.path.join(os.path.dirname(__file__), "test_data")
 
 
 class TestUtilities(object):
+    def test_shard(self, tmp_path):
+        assert parse_shard("2/4") == (2, 4)
+        for shard in ["0/4", "5/4", "2", "a/4"]:
+            with pytest.raises(Exception):
+                parse_shard(shard)
+        samples = []
+        for i, size in enumerate([10, 70, 30, 30, 50, 20]):
+            bam_name = str(tmp_path / ("S%i.bam" % i))
+            with open(bam_name, "w") as bam_file:
+                bam_file.write("x" * size)
+            samples.append(("S%i" % i, bam_name, None))
+        shards = [get_shard(samples, i, 3) for i in [1, 2, 3]]
+        assert [[a[0] for a in shard] for shard in shards] == [
+            ["S1"],
+            ["S4", "S5"],
+            ["S0", "S2", "S3"],
+        ]
+
+        manifest = str(tmp_path / "manifest.txt")
+        with open(manifest, "w") as manifest_file:
+            for sample in samples + samples[:1]:
+                manifest_file.write(sample[1] + "\n")
+        assert get_sample_order(manifest) == {
+            "S%i" % i: i for i in range(len(samples))
+        }
+
     def test_parse_reigon_file(self):
         region_file = os.path.join(test_data_dir, "SMN_region_19_short.bed")
         region_dic = parse_region_file(region_file)
         assert len(region_dic["norm"]) == 500
         assert len(region_dic["exon16"]) == 2
         assert len(region_dic["exon78"]) == 2
+
+    def test_alignment_session(self):
+        bam = os.path.join(test_data_dir, "NA12878.bam")
+        with AlignmentSession(bam) as session:
+            bamfile = session.handle
+            # the same handle is shared by every stage
+            with alignment_handle(session) as stage_handle:
+                assert stage_handle is bamfile
+            assert bamfile.is_open
+            with alignment_handle(bam) as own_handle:
+                assert own_handle is not bamfile
+            assert not own_handle.is_open
+        assert not bamfile.is_open
+
+    def test_worker_session(self):
+        bam1 = os.path.join(test_data_dir, "NA12878.bam")
+        bam2 = os.path.join(test_data_dir, "NA12885.bam")
+        session = get_worker_session(bam1)
+        handle = session.handle
+        assert get_worker_session(bam1).handle is handle
+        assert get_worker_session(bam2).alignment_file == bam2
+        assert not handle.is_open
+        get_worker_session(bam2).close()
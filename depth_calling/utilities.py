@@ -20,8 +20,13 @@
 #
 #
 
+import os
+import logging
 from collections import namedtuple
-import pysam
+from contextlib import contextmanager
+from .parallel import partition_by_size
+
+_worker_session = None
 
 
 def parse_region_file(region_file):
@@ -39,6 +44,83 @@ def parse_region_file(region_file):
     return region_dic
 
 
+def get_sample_id(bam_name):
+    """Return the sample id of an alignment file listed in the manifest."""
+    return os.path.splitext(os.path.basename(bam_name))[0]
+
+
+def get_samples(manifest, path_count_file=None):
+    """
+    Return the samples listed in the manifest whose input files exist,
+    in manifest order.
+    """
+    samples = []
+    sample_ids = set()
+    with open(manifest) as read_manifest:
+        for line in read_manifest:
+            bam_name = line.strip()
+            sample_id = get_sample_id(bam_name)
+            count_file = None
+            if path_count_file is not None:
+                count_file = os.path.join(path_count_file, sample_id + "_count.txt")
+            if count_file is None and os.path.exists(bam_name) == 0:
+                logging.warning(
+                    "Input alignmet file for sample %s does not exist.", sample_id
+                )
+            elif count_file is not None and os.path.exists(count_file) == 0:
+                logging.warning(
+                    "Input count file for sample %s does not exist", sample_id
+                )
+            elif sample_id not in sample_ids:
+                # Only the first occurrence of a sample is reported.
+                sample_ids.add(sample_id)
+                samples.append((sample_id, bam_name, count_file))
+    return samples
+
+
+def get_sample_order(manifest):
+    """Return the position of each sample in the manifest, keyed by sample id."""
+    sample_order = {}
+    with open(manifest) as read_manifest:
+        for line in read_manifest:
+            sample_id = get_sample_id(line.strip())
+            sample_order.setdefault(sample_id, len(sample_order))
+    return sample_order
+
+
+def parse_shard(shard):
+    """Return the shard number and the number of shards of an i/N shard."""
+    try:
+        shard_number, num_shards = [int(a) for a in shard.split("/")]
+    except ValueError:
+        shard_number, num_shards = 0, 0
+    if not 1 <= shard_number <= num_shards:
+        raise Exception(
+            "Shard %s not recognized. Use i/N with i between 1 and N." % shard
+        )
+    return shard_number, num_shards
+
+
+def get_sample_size(sample):
+    """Return the size of the input file of a sample, or 0 if it is not found."""
+    _, bam_name, count_file = sample
+    for input_file in [bam_name, count_file]:
+        if input_file is not None and os.path.exists(input_file):
+            return os.path.getsize(input_file)
+    return 0
+
+
+def get_shard(samples, shard_number, num_shards):
+    """
+    Return the samples of shard shard_number (1-based) out of num_shards,
+    in manifest order. Samples are spread over the shards by input file size
+    so that every shard has a similar amount of data to read.
+    """
+    sizes = [get_sample_size(a) for a in samples]
+    shard_indexes = partition_by_size(sizes, num_shards)[shard_number - 1]
+    return [samples[i] for i in shard_indexes]
+
+
 def parse_gmm_file(gmm_file):
     """Return the gmm parameters stored in input file."""
     dpar_tmp = {}
@@ -52,8 +134,81 @@ def parse_gmm_file(gmm_file):
 
 
 def open_alignment_file(alignment_file, reference_fasta=None):
+    import pysam
+
     if alignment_file.endswith("cram"):
         return pysam.AlignmentFile(
             alignment_file, "rc", reference_filename=reference_fasta
         )
     return pysam.AlignmentFile(alignment_file, "rb")
+
+
+class AlignmentSession:
+    """
+    An alignment file that is opened once, with its header, index and
+    reference, and shared by all stages that process a sample.
+    """
+
+    def __init__(self, alignment_file, reference_fasta=None):
+        self.alignment_file = alignment_file
+        self.reference_fasta = reference_fasta
+        self._handle = None
+
+    @property
+    def handle(self):
+        """Return the open alignment file, opening it on first use."""
+        if self._handle is None:
+            self._handle = open_alignment_file(
+                self.alignment_file, self.reference_fasta
+            )
+        return self._handle
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_alignment_source(bamf, reference_fasta=None):
+    """Return the path and reference of an alignment file or session."""
+    if isinstance(bamf, AlignmentSession):
+        return bamf.alignment_file, bamf.reference_fasta
+    return bamf, reference_fasta
+
+
+@contextmanager
+def alignment_handle(bamf, reference_fasta=None):
+    """
+    Yield an open alignment file. The handle of a session is shared and left
+    open, while a path is opened and closed here.
+    """
+    if isinstance(bamf, AlignmentSession):
+        yield bamf.handle
+    else:
+        bamfile = open_alignment_file(bamf, reference_fasta)
+        try:
+            yield bamfile
+        finally:
+            bamfile.close()
+
+
+def get_worker_session(alignment_file, reference_fasta=None):
+    """
+    Return the session of a worker process for an alignment file.
+    The file stays open across tasks until a different file is requested.
+    """
+    global _worker_session
+    if _worker_session is None or (
+        _worker_session.alignment_file,
+        _worker_session.reference_fasta,
+    ) != (alignment_file, reference_fasta):
+        if _worker_session is not None:
+            _worker_session.close()
+        _worker_session = AlignmentSession(alignment_file, reference_fasta)
+    return _worker_session
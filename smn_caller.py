@@ -26,25 +26,21 @@ import argparse
 import json
 import logging
 import datetime
-from collections import namedtuple
-import pysam
+from functools import partial
 
 
-from depth_calling.snp_count import get_supporting_reads, get_fraction, get_snp_position
-from depth_calling.gmm import Gmm
-from depth_calling.utilities import (
-    parse_gmm_file,
-    parse_region_file,
-    open_alignment_file,
+from depth_calling.snp_count import SNP_COUNT_ENGINES
+from depth_calling.utilities import get_samples, parse_shard, get_shard
+from depth_calling.bin_count import COUNT_ENGINES, GC_ENGINES
+from depth_calling.count_cache import CountCache
+from depth_calling.parallel import split_threads, run_samples
+from caller.smn_cn_caller import SmnCaller
+from caller.output import (
+    write_to_tsv,
+    StreamingOutput,
+    resume_streaming_output,
+    finalize_json,
 )
-from depth_calling.bin_count import (
-    get_normed_depth,
-    get_normed_depth_from_count,
-    get_read_length,
-)
-from caller.call_smn12 import get_smn12_call
-
-MAD_THRESHOLD = 0.11
 
 
 def load_parameters():
@@ -70,6 +66,13 @@ def load_parameters():
         default=1,
         required=False,
     )
+    parser.add_argument(
+        "--parallelSamples",
+        help="Optional number of samples to process at the same time. \
+        By default this is derived from --threads",
+        type=int,
+        required=False,
+    )
     parser.add_argument(
         "--reference",
         help="Optional path to reference fasta file for CRAM",
@@ -78,139 +81,84 @@ def load_parameters():
     parser.add_argument(
         "--countFilePath", help="Optional path to count files", required=False
     )
-
-    args = parser.parse_args()
-    if args.genome not in ["19", "37", "38"]:
-        raise Exception("Genome not recognized. Select from 19, 37, or 38")
-
-    return args
-
-
-def smn_cn_caller(
-    bam,
-    region_dic,
-    gmm_parameter,
-    snp_db,
-    variant_db,
-    threads,
-    count_file=None,
-    reference_fasta=None,
-):
-    """Return SMN CN calls for each sample."""
-    # 1. read counting, normalization
-    if count_file is not None:
-        bamfile = open_alignment_file(bam, reference_fasta)
-        reads = bamfile.fetch()
-        read_length = get_read_length(reads)
-        bamfile.close()
-        normalized_depth = get_normed_depth_from_count(
-            count_file, region_dic, read_length, gc_correct=False
-        )
-    else:
-        normalized_depth = get_normed_depth(
-            bam, region_dic, threads, reference=reference_fasta, gc_correct=False
-        )
-
-    # 2. GMM and CN call
-    cn_call = namedtuple("cn_call", "exon16_cn exon16_depth exon78_cn exon78_depth")
-    gmm_exon16 = Gmm()
-    gmm_exon16.set_gmm_par(gmm_parameter, "exon1-6")
-    gcall_exon16 = gmm_exon16.gmm_call(normalized_depth.normalized["exon16"])
-    gmm_exon78 = Gmm()
-    gmm_exon78.set_gmm_par(gmm_parameter, "exon7-8")
-    gcall_exon78 = gmm_exon78.gmm_call(normalized_depth.normalized["exon78"])
-    raw_cn_call = cn_call(
-        gcall_exon16.cn,
-        gcall_exon16.depth_value,
-        gcall_exon78.cn,
-        gcall_exon78.depth_value,
+    parser.add_argument(
+        "--countEngine",
+        help="Engine used to count reads in regions. window counts nearby \
+        regions from a single fetch. Default is pysam",
+        choices=COUNT_ENGINES,
+        default="pysam",
+        required=False,
     )
-
-    # 3. Get SNP ratios
-    smn1_read_count, smn2_read_count = get_supporting_reads(
-        bam,
-        snp_db.dsnp1,
-        snp_db.dsnp2,
-        snp_db.nchr,
-        snp_db.dindex,
-        reference=reference_fasta,
+    parser.add_argument(
+        "--snpEngine",
+        help="Engine used to count reads supporting each allele at SNP sites. \
+        single_pass fetches the reads of each gene once and matches every read \
+        against all sites it covers, pileup builds a pileup at each site. \
+        Default is single_pass",
+        choices=sorted(SNP_COUNT_ENGINES),
+        default="single_pass",
+        required=False,
     )
-    smn1_fraction = get_fraction(smn1_read_count, smn2_read_count)
-    var_ref_count, var_alt_count = get_supporting_reads(
-        bam,
-        variant_db.dsnp1,
-        variant_db.dsnp2,
-        variant_db.nchr,
-        variant_db.dindex,
-        reference=reference_fasta,
+    parser.add_argument(
+        "--gcEngine",
+        help="Engine used to fit depth against GC content for the coverage MAD. \
+        lowess runs statsmodels for each sample, precomputed computes the LOWESS \
+        weights of the region file once for all samples, binned interpolates \
+        between median depths of GC bins. Default is precomputed",
+        choices=sorted(GC_ENGINES),
+        default="precomputed",
+        required=False,
     )
-
-    # 4. Call CN of SMN1 and SMN2
-    final_call = get_smn12_call(
-        raw_cn_call,
-        smn1_read_count,
-        smn2_read_count,
-        var_ref_count,
-        var_alt_count,
-        normalized_depth.mediandepth,
+    parser.add_argument(
+        "--cacheDir",
+        help="Optional directory to cache the read counts of each alignment file. \
+        Cached counts are reused until the alignment file or region file changes",
+        required=False,
     )
-
-    # 5. Prepare final call set
-    sample_call = namedtuple(
-        "sample_call",
-        "Coverage_MAD Median_depth \
-        Full_length_CN_raw Total_CN_raw \
-        SMN1_read_support SMN2_read_support SMN1_fraction \
-        g27134TG_REF_count g27134TG_ALT_count",
+    parser.add_argument(
+        "--cacheSize",
+        help="Maximum size of the count cache in MB, the least recently used \
+        entries are removed beyond it. Default is 1024",
+        type=int,
+        default=1024,
+        required=False,
+    )
+    parser.add_argument(
+        "--shard",
+        help="Optional shard of the manifest to call, as i/N for shard i of N. \
+        Samples are spread over the shards by file size. The jsonl output of \
+        all shards is combined with smn_merge.py",
+        required=False,
     )
-    sample_cn_call = sample_call(
-        round(normalized_depth.mad, 3),
-        round(normalized_depth.mediandepth, 2),
-        raw_cn_call.exon78_depth,
-        raw_cn_call.exon16_depth,
-        smn1_read_count,
-        smn2_read_count,
-        [round(a, 2) for a in smn1_fraction],
-        var_ref_count,
-        var_alt_count,
+    parser.add_argument(
+        "--streamOutput",
+        help="Write each sample to the jsonl and tsv output as soon as it is \
+        called. The json output is produced from the jsonl at the end of the run",
+        action="store_true",
+        required=False,
     )
+    parser.add_argument(
+        "--resume",
+        help="Continue an interrupted --streamOutput run with the same outDir \
+        and prefix, skipping samples that are already in the jsonl output",
+        action="store_true",
+        required=False,
+    )
+
+    args = parser.parse_args()
+    if args.genome not in ["19", "37", "38"]:
+        raise Exception("Genome not recognized. Select from 19, 37, or 38")
+    if args.shard is not None:
+        args.shard = parse_shard(args.shard)
 
-    doutput = sample_cn_call._asdict()
-    doutput.update(final_call._asdict())
-    return doutput
+    return args
 
 
-def write_to_tsv(final_output, out_tsv):
-    """Write to tsv output."""
-    header = [
-        "Sample",
-        "isSMA",
-        "isCarrier",
-        "SMN1_CN",
-        "SMN2_CN",
-        "SMN2delta7-8_CN",
-        "Total_CN_raw",
-        "Full_length_CN_raw",
-        "g.27134T>G_CN",
-        "SMN1_CN_raw",
-    ]
-    with open(out_tsv, "w") as tsv_output:
-        tsv_output.write("\t".join(header) + "\n")
-        for sample_id in final_output:
-            final_call = final_output[sample_id]
-            output_per_sample = [
-                sample_id,
-                final_call["isSMA"],
-                final_call["isCarrier"],
-                final_call["SMN1"],
-                final_call["SMN2"],
-                final_call["SMN2delta78"],
-                final_call["Total_CN_raw"],
-                final_call["Full_length_CN_raw"],
-                final_call["g27134TG_CN"],
-                ",".join([str(a) for a in final_call["SMN1_CN_raw"]]),
-            ]
-            tsv_output.write("\t".join([str(a) for a in output_per_sample]) + "\n")
+def process_sample(sample, smn_caller):
+    """Return the sample id and SMN CN calls for one manifest entry."""
+    sample_id, bam_name, count_file = sample
+    logging.info("Processing sample %s at %s", sample_id, datetime.datetime.now())
+    return sample_id, smn_caller.call_sample(sample_id, bam_name, count_file)
 
 
 def main():
@@ -224,74 +172,84 @@ def main():
     path_count_file = parameters.countFilePath
     logging.basicConfig(level=logging.DEBUG)
 
-    datadir = os.path.join(os.path.dirname(__file__), "data")
-    # Region file to use
-    region_file = os.path.join(datadir, "SMN_region_%s.bed" % genome)
-    snp_file = os.path.join(datadir, "SMN_SNP_%s.txt" % genome)
-    variant_file = os.path.join(datadir, "SMN_target_variant_%s.txt" % genome)
-    gmm_file = os.path.join(datadir, "SMN_gmm.txt")
-
-    for required_file in [region_file, snp_file, variant_file, gmm_file]:
-        if os.path.exists(required_file) == 0:
-            raise Exception("File %s not found." % required_file)
-
     if os.path.exists(outdir) == 0:
         os.makedirs(outdir)
 
-    snp_db = get_snp_position(snp_file)
-    variant_db = get_snp_position(variant_file)
-    gmm_parameter = parse_gmm_file(gmm_file)
-    region_dic = parse_region_file(region_file)
     out_json = os.path.join(outdir, prefix + ".json")
     out_tsv = os.path.join(outdir, prefix + ".tsv")
-    final_output = {}
-    with open(manifest) as read_manifest:
-        for line in read_manifest:
-            bam_name = line.strip()
-            sample_id = os.path.splitext(os.path.basename(bam_name))[0]
-            count_file = None
-            if path_count_file is not None:
-                count_file = os.path.join(path_count_file, sample_id + "_count.txt")
-            if count_file is None and os.path.exists(bam_name) == 0:
-                logging.warning(
-                    "Input alignmet file for sample %s does not exist.", sample_id
-                )
-            elif count_file is not None and os.path.exists(count_file) == 0:
-                logging.warning(
-                    "Input count file for sample %s does not exist", sample_id
-                )
-            else:
-                logging.info(
-                    "Processing sample %s at %s", sample_id, datetime.datetime.now()
-                )
-                smn_call = smn_cn_caller(
-                    bam_name,
-                    region_dic,
-                    gmm_parameter,
-                    snp_db,
-                    variant_db,
-                    threads,
-                    count_file,
-                    reference_fasta,
-                )
-                # Use normalized coverage MAD across stable regions
-                # as a sample QC measure.
-                if smn_call["Coverage_MAD"] > MAD_THRESHOLD:
-                    logging.warning(
-                        "Sample %s has uneven coverage. CN calls may be \
-                            unreliable.",
-                        sample_id,
-                    )
-                final_output.setdefault(sample_id, smn_call)
+    out_jsonl = os.path.join(outdir, prefix + ".jsonl")
+    samples = get_samples(manifest, path_count_file)
+    if parameters.shard is not None:
+        samples = get_shard(samples, *parameters.shard)
+        logging.info(
+            "Calling %i samples in shard %i of %i",
+            len(samples),
+            parameters.shard[0],
+            parameters.shard[1],
+        )
+    count_cache = None
+    if parameters.cacheDir is not None:
+        count_cache = CountCache(
+            parameters.cacheDir, parameters.cacheSize * 1024 * 1024
+        )
+    resume = parameters.resume and os.path.exists(out_jsonl)
+    if resume:
+        completed_samples = resume_streaming_output(out_jsonl, out_tsv)
+        samples = [a for a in samples if a[0] not in completed_samples]
+        logging.info(
+            "Resuming with %i samples already called, %i samples remaining",
+            len(completed_samples),
+            len(samples),
+        )
+    if path_count_file is not None:
+        # Regions are not counted from count files, so the whole budget goes
+        # to samples and no region counting pools are started.
+        sample_workers = max(1, min(threads, len(samples)))
+        if parameters.parallelSamples is not None:
+            sample_workers = max(1, min(sample_workers, parameters.parallelSamples))
+        region_threads = 1
+    else:
+        sample_workers, region_threads = split_threads(
+            threads, len(samples), parameters.parallelSamples
+        )
+    logging.info(
+        "Processing %i samples at a time with %i threads each",
+        sample_workers,
+        region_threads,
+    )
+    smn_caller = SmnCaller(
+        genome,
+        region_threads,
+        reference_fasta,
+        count_engine=parameters.countEngine,
+        count_cache=count_cache,
+        gc_engine=parameters.gcEngine,
+        snp_engine=parameters.snpEngine,
+    )
+    process = partial(process_sample, smn_caller=smn_caller)
+    sample_calls = run_samples(process, samples, sample_workers, region_threads)
+    # Shards always write jsonl output for smn_merge.py
+    if parameters.streamOutput or parameters.resume or parameters.shard is not None:
+        with StreamingOutput(out_jsonl, out_tsv, resume) as streaming_output:
+            for sample_id, smn_call in sample_calls:
+                streaming_output.write(sample_id, smn_call)
+
+        # Write to json
+        logging.info("Writing to json at %s", datetime.datetime.now())
+        finalize_json(out_jsonl, out_json)
+    else:
+        final_output = {}
+        for sample_id, smn_call in sample_calls:
+            final_output.setdefault(sample_id, smn_call)
 
-    # Write to json
-    logging.info("Writing to json at %s", datetime.datetime.now())
-    with open(out_json, "w") as json_output:
-        json.dump(final_output, json_output)
+        # Write to json
+        logging.info("Writing to json at %s", datetime.datetime.now())
+        with open(out_json, "w") as json_output:
+            json.dump(final_output, json_output)
 
-    # Write to tsv
-    logging.info("Writing to tsv at %s", datetime.datetime.now())
-    write_to_tsv(final_output, out_tsv)
+        # Write to tsv
+        logging.info("Writing to tsv at %s", datetime.datetime.now())
+        write_to_tsv(final_output, out_tsv)
 
 
 if __name__ == "__main__":
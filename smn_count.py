@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+import os
+import argparse
+import logging
+import datetime
+from collections import OrderedDict
+from functools import partial
+
+
+from depth_calling.utilities import parse_region_file, get_samples, AlignmentSession
+from depth_calling.bin_count import get_region_counts, write_count_file, COUNT_ENGINES
+from depth_calling.snp_count import (
+    get_supporting_reads_panels,
+    load_site_panel,
+    SNP_COUNT_ENGINES,
+)
+from depth_calling.parallel import run_samples
+from caller.smn_cn_caller import COUNT_FILE_ALLELE_KEYS
+
+
+def load_parameters():
+    """Return parameters."""
+    parser = argparse.ArgumentParser(
+        description="Count reads in the SMN caller regions from WGS bam files and \
+        write count files for smn_caller.py --countFilePath."
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Manifest listing absolute paths to input BAM/CRAM files",
+        required=True,
+    )
+    parser.add_argument(
+        "--genome", help="Reference genome, select from 19, 37, or 38", required=True
+    )
+    parser.add_argument("--outDir", help="Output directory", required=True)
+    parser.add_argument(
+        "--threads",
+        help="Number of samples to count at the same time. Default is 1",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--reference",
+        help="Optional path to reference fasta file for CRAM",
+        required=False,
+    )
+    parser.add_argument(
+        "--countEngine",
+        help="Engine used to count reads in regions. Default is pysam",
+        choices=COUNT_ENGINES,
+        default="pysam",
+        required=False,
+    )
+    parser.add_argument(
+        "--snpEngine",
+        help="Engine used to count reads supporting each allele at SNP sites. \
+        Default is single_pass",
+        choices=sorted(SNP_COUNT_ENGINES),
+        default="single_pass",
+        required=False,
+    )
+
+    args = parser.parse_args()
+    if args.genome not in ["19", "37", "38"]:
+        raise Exception("Genome not recognized. Select from 19, 37, or 38")
+
+    return args
+
+
+def count_sample(
+    sample,
+    region_dic,
+    snp_db,
+    variant_db,
+    outdir,
+    reference_fasta,
+    count_engine="pysam",
+    snp_engine="single_pass",
+):
+    """
+    Write the count file of one manifest entry and return its path.
+    The read length and the allele counts at the SNP and target variant sites
+    are stored in the count file, so that smn_caller.py can call the sample
+    without the alignment file.
+    """
+    sample_id, bam_name, _ = sample
+    logging.info("Counting sample %s at %s", sample_id, datetime.datetime.now())
+    with AlignmentSession(bam_name, reference_fasta) as session:
+        count_dic, read_length = get_region_counts(
+            session, region_dic, count_engine=count_engine
+        )
+        snp_read_count, variant_read_count = get_supporting_reads_panels(
+            session, [snp_db, variant_db], snp_engine=snp_engine
+        )
+    count_meta = OrderedDict([("read_length", float(read_length))])
+    for keys, allele_counts in zip(
+        COUNT_FILE_ALLELE_KEYS, [snp_read_count, variant_read_count]
+    ):
+        count_meta.update(zip(keys, allele_counts))
+    count_file = os.path.join(outdir, sample_id + "_count.txt")
+    write_count_file(count_file, region_dic, count_dic, count_meta)
+    return count_file
+
+
+def main():
+    parameters = load_parameters()
+    manifest = parameters.manifest
+    outdir = parameters.outDir
+    genome = parameters.genome
+    logging.basicConfig(level=logging.DEBUG)
+
+    datadir = os.path.join(os.path.dirname(__file__), "data")
+    # Region file to use
+    region_file = os.path.join(datadir, "SMN_region_%s.bed" % genome)
+    snp_file = os.path.join(datadir, "SMN_SNP_%s.txt" % genome)
+    variant_file = os.path.join(datadir, "SMN_target_variant_%s.txt" % genome)
+
+    for required_file in [region_file, snp_file, variant_file]:
+        if os.path.exists(required_file) == 0:
+            raise Exception("File %s not found." % required_file)
+
+    if os.path.exists(outdir) == 0:
+        os.makedirs(outdir)
+
+    region_dic = parse_region_file(region_file)
+    snp_db = load_site_panel(snp_file)
+    variant_db = load_site_panel(variant_file)
+    samples = get_samples(manifest)
+    process = partial(
+        count_sample,
+        region_dic=region_dic,
+        snp_db=snp_db,
+        variant_db=variant_db,
+        outdir=outdir,
+        reference_fasta=parameters.reference,
+        count_engine=parameters.countEngine,
+        snp_engine=parameters.snpEngine,
+    )
+    # Each sample is counted in a single process
+    sample_workers = max(1, min(parameters.threads, len(samples)))
+    for count_file in run_samples(process, samples, sample_workers):
+        logging.info("Wrote %s at %s", count_file, datetime.datetime.now())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# SMNCopyNumberCaller
+# Copyright 2019-2020 Illumina, Inc.
+# All rights reserved.
+#
+# Author: Xiao Chen <xchen2@illumina.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+
+
+import os
+import argparse
+import logging
+import datetime
+
+
+from depth_calling.utilities import get_sample_order
+from caller.output import merge_jsonl
+
+
+def load_parameters():
+    """Return parameters."""
+    parser = argparse.ArgumentParser(
+        description="Merge the jsonl output of smn_caller.py --shard runs into \
+        a single json and tsv output in manifest order."
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Manifest listing absolute paths to input BAM/CRAM files, \
+        as given to the shards",
+        required=True,
+    )
+    parser.add_argument(
+        "--inputs",
+        help="jsonl output files of the shards",
+        nargs="+",
+        required=True,
+    )
+    parser.add_argument("--outDir", help="Output directory", required=True)
+    parser.add_argument("--prefix", help="Prefix to output file", required=True)
+
+    return parser.parse_args()
+
+
+def main():
+    parameters = load_parameters()
+    outdir = parameters.outDir
+    prefix = parameters.prefix
+    logging.basicConfig(level=logging.DEBUG)
+
+    for required_file in [parameters.manifest] + parameters.inputs:
+        if os.path.exists(required_file) == 0:
+            raise Exception("File %s not found." % required_file)
+
+    if os.path.exists(outdir) == 0:
+        os.makedirs(outdir)
+
+    out_json = os.path.join(outdir, prefix + ".json")
+    out_tsv = os.path.join(outdir, prefix + ".tsv")
+    sample_order = get_sample_order(parameters.manifest)
+    logging.info(
+        "Merging %i shards at %s", len(parameters.inputs), datetime.datetime.now()
+    )
+    merge_jsonl(parameters.inputs, sample_order, out_json, out_tsv)
+    logging.info("Wrote %s and %s at %s", out_json, out_tsv, datetime.datetime.now())
+
+
+if __name__ == "__main__":
+    main()